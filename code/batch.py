@@ -0,0 +1,771 @@
+"""
+批量压缩引擎模块
+使用进程池将压缩任务分发到多个 CPU 核心，可选地用线程池预读输入、延后写入输出
+"""
+import heapq
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+
+from cache import hash_bytes
+from compressors import (
+    CompressionResult,
+    compress_image_best_format,
+    compress_image_fixed_quality,
+    compress_image_renditions,
+    compress_image_to_size,
+    estimate_jpeg_sizes,
+    estimate_peak_memory,
+    write_deferred,
+)
+from metrics import measure
+from planner import PLAN_QUALITIES, plan_target_sizes
+from predictor import QualityPredictor
+
+# 流式输入时用于按代价重排任务的缓冲区大小
+SCHEDULE_WINDOW = 256
+
+# 默认内存预算占物理内存的比例
+MEMORY_BUDGET_RATIO = 0.5
+
+# 等待内存时最多预读的超大任务数
+LANE_LOOKAHEAD = 64
+
+
+def get_default_workers():
+    """
+    获取默认工作进程数
+
+    Returns:
+        int: CPU 核心数
+    """
+    return os.cpu_count() or 1
+
+
+def get_default_memory_budget():
+    """
+    获取默认内存预算
+
+    Returns:
+        int: 物理内存的一半（字节），无法获取时为 None（不限制）
+    """
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+    return int(total * MEMORY_BUDGET_RATIO)
+
+
+def get_memory_cost(job):
+    """
+    估算任务的内存峰值，job 的第一个元素为输入图片路径
+
+    Args:
+        job: (input_path, ...)
+
+    Returns:
+        int: 估算的峰值内存（字节）
+    """
+    return estimate_peak_memory(job[0])
+
+
+class AdmissionQueue:
+    """
+    按内存预算放行任务
+
+    已提交任务的估算内存之和不超过预算时才放行新任务。
+    估算内存超过单个进程平均份额的超大图片走单独通道，同一时间只运行一个，
+    其余进程继续处理小图片；没有任何任务在运行时总会放行下一个任务，
+    以免单张图片超出预算时卡死
+    """
+
+    def __init__(self, memory, budget, max_workers):
+        """
+        Args:
+            memory: job -> 估算内存（字节），加入任务时未给出估算内存才调用
+            budget: 内存预算（字节），None 表示不限制
+            max_workers: 工作进程数
+        """
+        self.memory = memory
+        self.budget = budget
+        self.lane_threshold = None if budget is None else budget / max_workers
+        self.small = deque()
+        self.large = deque()
+        self.in_use = 0
+        self.large_running = False
+
+    def __len__(self):
+        return len(self.small) + len(self.large)
+
+    def wants_more(self):
+        """是否需要加入更多任务：没有可放行的小任务，且预读的超大任务未达上限"""
+        return not self.small and len(self.large) < LANE_LOOKAHEAD
+
+    def add(self, job, cost=None):
+        """
+        加入一个需要执行的任务
+
+        Args:
+            job: 任务
+            cost: 估算内存（字节），None 时按需调用 memory 估算（不限制内存时不估算）
+        """
+        if cost is None:
+            cost = 0 if self.budget is None else self.memory(job)
+        if self.lane_threshold is not None and cost > self.lane_threshold:
+            self.large.append((job, cost))
+        else:
+            self.small.append((job, cost))
+
+    def _fits(self, cost, idle):
+        return idle or self.budget is None or self.in_use + cost <= self.budget
+
+    def pop(self, idle):
+        """
+        取出下一个可提交的任务
+
+        Args:
+            idle: 当前是否没有任何任务在运行
+
+        Returns:
+            tuple: (job, cost, large)，当前内存不足或已没有任务时为 None
+        """
+        if self.large and not self.large_running:
+            job, cost = self.large[0]
+            if not self._fits(cost, idle):
+                # 等待超大任务所需内存时暂停放行小任务，避免其一直无法启动
+                return None
+            self.large.popleft()
+            self.large_running = True
+            self.in_use += cost
+            return job, cost, True
+        if self.small:
+            job, cost = self.small[0]
+            if not self._fits(cost, idle):
+                return None
+            self.small.popleft()
+            self.in_use += cost
+            return job, cost, False
+        return None
+
+    def release(self, cost, large):
+        """任务结束后归还内存"""
+        self.in_use -= cost
+        if large:
+            self.large_running = False
+
+
+def get_file_size_cost(stats=None):
+    """
+    生成以输入文件大小作为任务代价的估算函数
+
+    文件大小在扫描时已经得到，不需要额外读取文件头，
+    也不会给随后命中缓存的任务带来多余的 I/O
+
+    Args:
+        stats: 扫描时记录的 {path: (size, mtime_ns)}
+
+    Returns:
+        callable: job -> 代价
+    """
+    stats = stats or {}
+
+    def cost(job):
+        stat = stats.get(job[0])
+        if stat is not None:
+            return stat[0]
+        try:
+            return os.path.getsize(job[0])
+        except OSError:
+            return 0
+
+    return cost
+
+
+def order_largest_first(jobs, cost, window=SCHEDULE_WINDOW):
+    """
+    按代价从大到小排列任务（最长处理时间优先），缩短并行批处理末尾的长尾
+
+    jobs 为列表时整体排序；为流式的迭代器时只在 window 大小的缓冲区内重排，
+    以免等待扫描结束才开始压缩
+
+    Args:
+        jobs: 任务列表或迭代器
+        cost: job -> 代价 的估算函数
+        window: 流式输入的重排缓冲区大小
+
+    Yields:
+        job: 重排后的任务
+    """
+    if isinstance(jobs, list):
+        yield from sorted(jobs, key=cost, reverse=True)
+        return
+
+    heap = []
+    for counter, job in enumerate(jobs):
+        heapq.heappush(heap, (-cost(job), counter, job))
+        if len(heap) >= window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def _prefetch(path, hashed):
+    """
+    在 I/O 线程中读取整个输入文件，并从读入的内容计算哈希、估算内存，
+    调度线程不再为哈希或文件头读取输入
+
+    Args:
+        path: 输入文件路径
+        hashed: 是否计算内容哈希（启用缓存或去重时需要）
+
+    Returns:
+        tuple: (文件内容, 内容哈希或 None, 估算的峰值内存)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    content_hash = hash_bytes(data) if hashed else None
+    return data, content_hash, estimate_peak_memory(io.BytesIO(data))
+
+
+def _write_behind(result):
+    """
+    在 I/O 线程中完成延后的写入
+
+    Returns:
+        tuple: (result, 写入耗时)
+    """
+    start = time.perf_counter()
+    write_deferred(result)
+    return result, time.perf_counter() - start
+
+
+def _no_options(job):
+    return {}
+
+
+class _Completion:
+    """
+    任务完成前后的记录：结果缓存、进度日志、重复输入合并和运行报告
+
+    顺序执行和并行执行共用，两种方式的记录逻辑保持一致
+    """
+
+    def __init__(self, kind, cache=None, journal=None, dedupe=None, report=None):
+        """
+        Args:
+            kind: 压缩类型（压缩函数名），用作缓存和进度日志的键
+            cache: ResultCache 实例或 None
+            journal: Journal 实例或 None
+            dedupe: Deduplicator 实例或 None
+            report: RunReport 实例或 None
+        """
+        self.kind = kind
+        self.cache = cache
+        self.journal = journal
+        self.dedupe = dedupe
+        self.report = report
+
+    @property
+    def hashed(self):
+        """查找缓存或合并重复图片是否需要输入文件的内容哈希"""
+        return self.cache is not None or self.dedupe is not None
+
+    def needs_read(self, job):
+        """查找缓存前是否必须读取输入文件计算内容哈希"""
+        return self.cache is not None and self.cache.needs_read(self.kind, job)
+
+    def resolve(self, job, content_hash=None, use_cache=True):
+        """
+        查找无需执行即可完成的结果：进度日志、同一输入的结果缓存，以及内容相同的其他任务
+        （本次运行中的，或结果缓存中以前运行的）
+
+        Args:
+            job: 任务
+            content_hash: 已从读入的内容计算出的哈希，给出时不再读取输入文件
+            use_cache: 是否查找结果缓存（已查找过时为 False）
+
+        Returns:
+            list | None: 现在即可返回的 [(job, result, error)]（重复任务等待代表完成时为空列表）；
+                任务需要执行时为 None
+        """
+        cached = self.lookup(job, content_hash, use_cache)
+        if cached is not None:
+            return self.finish(job, cached, record=False)
+        if self.dedupe is None:
+            return None
+        claimed = self.dedupe.claim(job, content_hash)
+        if claimed is not None:
+            return [self._duplicate_done(duplicate, result) for duplicate, result in claimed]
+        # 本次运行中的第一张，再查找以前运行中内容相同的其他输入的输出
+        found = self.cache.find_output(self.kind, job, content_hash) if self.cache is not None else None
+        reused = self.dedupe.reuse(job, *found) if found is not None else None
+        if reused is None:
+            return None
+        if self.report is not None:
+            self.report.add_deduplicated(job[0])
+        return self.finish(job, reused)
+
+    def lookup(self, job, content_hash=None, use_cache=True):
+        """
+        查找进度日志或结果缓存中的结果
+
+        Returns:
+            CompressionResult | None: 命中时返回复用的结果，否则为 None
+        """
+        cached = self.journal.lookup(self.kind, job) if self.journal is not None else None
+        if cached is not None:
+            if self.dedupe is not None:
+                self.dedupe.count_skipped()
+            return cached
+        cached = self.cache.lookup(self.kind, job, content_hash) if self.cache is not None and use_cache else None
+        if cached is not None:
+            if self.dedupe is not None:
+                self.dedupe.count_skipped()
+            if self.report is not None:
+                self.report.add_cached(job[0])
+            if self.journal is not None:
+                self.journal.record(self.kind, job, cached)
+        return cached
+
+    def unwrap(self, returned):
+        """
+        拆分任务的返回值，启用报告时任务通过 measure 执行，返回 (结果, 计量记录)
+
+        Returns:
+            tuple: (result, metrics)，未启用报告时 metrics 为 None
+        """
+        if self.report is None:
+            return returned, None
+        result, metrics = returned
+        self.report.add(metrics)
+        return result, metrics
+
+    def finish(self, job, result, error=None, record=True):
+        """
+        记录一个执行完成（或命中缓存）的任务，等待其结果的重复任务随之完成
+
+        Args:
+            job: 任务
+            result: 任务的结果，任务抛出异常时为 None
+            error: 任务抛出的异常
+            record: 是否写入缓存和进度日志（命中时已记录）
+
+        Returns:
+            list: [(job, result, error)]，该任务在前，其后为重复任务
+        """
+        if record:
+            self._record(job, result)
+        finished = [(job, result, error)]
+        if self.dedupe is not None:
+            for duplicate, duplicate_result in self.dedupe.complete(job, result, error):
+                finished.append(self._duplicate_done(duplicate, duplicate_result))
+        return finished
+
+    def _duplicate_done(self, job, result):
+        self._record(job, result)
+        if self.report is not None and result:
+            self.report.add_deduplicated(job[0])
+        return job, result, None
+
+    def _record(self, job, result):
+        if not result:
+            return
+        if self.cache is not None:
+            self.cache.store(self.kind, job, result.output_size, result.output_path)
+        if self.journal is not None:
+            self.journal.record(self.kind, job, result)
+
+
+def _run_sequential(call, jobs, completion, options):
+    """在当前进程中顺序执行任务"""
+    for job in jobs:
+        finished = completion.resolve(job)
+        if finished is None:
+            try:
+                result, _ = completion.unwrap(call(*job, **options(job)))
+            except Exception as e:
+                finished = completion.finish(job, None, e)
+            else:
+                finished = completion.finish(job, result)
+        yield from finished
+
+
+class _ParallelRun:
+    """
+    并行执行任务：（可选）I/O 线程预读输入，按内存预算放行，工作进程压缩，
+    （可选）I/O 线程延后写入
+
+    每个进行中的 Future 记录所处阶段（read / compute / write），完成后交给对应的处理函数
+    """
+
+    def __init__(self, call, jobs, completion, max_workers, memory_budget, options, io_workers):
+        self.call = call
+        self.completion = completion
+        self.options = options
+        self.jobs = iter(jobs)
+        self.exhausted = False
+        self.queue = AdmissionQueue(get_memory_cost, memory_budget, max_workers)
+        # 限制同时执行（及预读）的任务数，避免一次性为海量文件创建 Future
+        self.max_pending = max_workers * 2
+        self.max_workers = max_workers
+        self.io_workers = io_workers
+        # {future: (阶段, job, 阶段相关数据)}
+        self.pending = {}
+        # 已预读、等待放行的输入内容 {job: bytes}
+        self.sources = {}
+        self.finished = deque()
+        self.io_executor = None
+
+    def run(self):
+        """
+        Yields:
+            tuple: (job, result, error)，按完成顺序
+        """
+        if self.io_workers:
+            self.io_executor = ThreadPoolExecutor(max_workers=self.io_workers)
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        with self.executor:
+            try:
+                while True:
+                    self._feed()
+                    self._admit()
+                    while self.finished:
+                        yield self.finished.popleft()
+                    if not self.pending:
+                        # 没有任务在执行时总会放行，队列此时必为空
+                        if self.exhausted:
+                            break
+                        continue
+                    done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        phase, job, context = self.pending.pop(future)
+                        getattr(self, f"_{phase}_done")(future, job, context)
+                    while self.finished:
+                        yield self.finished.popleft()
+            finally:
+                # 调用方提前停止（如用户取消）时，丢弃尚未开始的任务
+                for future in self.pending:
+                    future.cancel()
+                if self.io_executor is not None:
+                    self.io_executor.shutdown(wait=True)
+
+    def _count(self, phase):
+        return sum(pending_phase == phase for pending_phase, _, _ in self.pending.values())
+
+    def _wants_job(self):
+        if self.io_executor is None:
+            return self.queue.wants_more()
+        # 预读的内容在放行前一直驻留内存，限制正在读取和等待放行的任务数
+        return self._count("read") + len(self.queue) < self.max_pending
+
+    def _feed(self):
+        """
+        取出后续任务直到有可放行的任务
+
+        进度日志、结果缓存和重复图片能完成的任务在估算内存之前完成，
+        只有需要执行的任务才读取文件头估算内存。启用 I/O 线程时，调度线程只查找
+        不需要读取输入的记录，内容哈希和文件头都在预读后从读入的内容得到
+        """
+        while not self.exhausted and self._wants_job() and len(self.finished) < self.max_pending:
+            try:
+                job = next(self.jobs)
+            except StopIteration:
+                self.exhausted = True
+                break
+            if self.io_executor is None:
+                finished = self.completion.resolve(job)
+                if finished is None:
+                    self.queue.add(job)
+                else:
+                    self.finished.extend(finished)
+                continue
+
+            deferred = self.completion.needs_read(job)
+            cached = self.completion.lookup(job, use_cache=not deferred)
+            if cached is not None:
+                self.finished.extend(self.completion.finish(job, cached, record=False))
+                continue
+            future = self.io_executor.submit(_prefetch, job[0], self.completion.hashed)
+            self.pending[future] = "read", job, deferred
+
+    def _admit(self):
+        """在内存预算内放行任务，提交给工作进程"""
+        while self._count("compute") < self.max_pending:
+            admitted = self.queue.pop(idle=not self._count("compute"))
+            if admitted is None:
+                break
+            job, memory, large = admitted
+            kwargs = self.options(job)
+            if self.io_executor is not None:
+                kwargs.update(source=self.sources.pop(job), defer_write=True)
+            self.pending[self.executor.submit(self.call, *job, **kwargs)] = "compute", job, (memory, large)
+
+    def _read_done(self, future, job, deferred):
+        if future.exception() is not None:
+            self.finished.extend(self.completion.finish(job, None, future.exception()))
+            return
+        source, content_hash, memory = future.result()
+        finished = self.completion.resolve(job, content_hash, use_cache=deferred)
+        if finished is not None:
+            self.finished.extend(finished)
+            return
+        self.sources[job] = source
+        self.queue.add(job, memory)
+
+    def _compute_done(self, future, job, context):
+        self.queue.release(*context)
+        if future.exception() is not None:
+            self.finished.extend(self.completion.finish(job, None, future.exception()))
+            return
+        result, metrics = self.completion.unwrap(future.result())
+        if self.io_executor is None:
+            self.finished.extend(self.completion.finish(job, result))
+        else:
+            self.pending[self.io_executor.submit(_write_behind, result)] = "write", job, metrics
+
+    def _write_done(self, future, job, metrics):
+        result, seconds = future.result()
+        if metrics is not None:
+            metrics.add_stage("write", seconds)
+            metrics.success = bool(result)
+        self.finished.extend(self.completion.finish(job, result))
+
+
+def run_batch(
+    func, jobs, max_workers=None, cache=None, cost=None, memory_budget=None, report=None, journal=None,
+    options=None, io_workers=None, dedupe=None,
+):
+    """
+    并行执行压缩任务，按完成顺序返回结果
+
+    Args:
+        func: 压缩函数（必须是模块级函数，以便传给子进程）
+        jobs: 参数元组的可迭代对象，每个元组作为 func 的位置参数
+        max_workers: 工作进程数，默认使用 CPU 核心数；为 1 时在当前进程中顺序执行
+        cache: ResultCache 实例，给出时 jobs 须为 (input_path, output_path, *params)
+            且 func 返回 CompressionResult，命中缓存的任务不再执行，直接返回缓存的结果
+        cost: job -> 代价 的估算函数，给出时并行执行按代价从大到小调度
+        memory_budget: 并行执行时的内存预算（字节），默认使用物理内存的一半
+        report: RunReport 实例，给出时记录每个任务的各阶段耗时和内存峰值
+        journal: Journal 实例，给出时跳过日志中已完成的任务，并为新完成的任务追加记录
+            （要求同 cache）
+        options: job -> 关键字参数字典，在任务提交时调用，结果作为关键字参数传给 func；
+            用于只影响执行过程、不影响结果的参数（如质量搜索的起点），不计入缓存和日志的键
+        io_workers: I/O 线程数，给出时并行执行由线程池预读输入文件、写入输出文件，
+            工作进程只从内存解码和编码；要求 func 支持 source 和 defer_write 关键字参数
+            并返回 CompressionResult。None 表示由工作进程自行读写
+        dedupe: Deduplicator 实例，给出时内容相同的输入只执行一次，其余任务共用其输出
+            （要求同 cache）
+
+    Yields:
+        tuple: (job, result, error)，result 为 func 的返回值；
+            任务抛出异常（如工作进程崩溃）时 result 为 None，error 为该异常
+    """
+    max_workers = max_workers or get_default_workers()
+    completion = _Completion(func.__name__, cache, journal, dedupe, report)
+    # 启用报告时通过 measure 执行，任务返回 (结果, 计量记录)
+    call = func if report is None else partial(measure, func)
+    options = options or _no_options
+
+    if max_workers == 1:
+        yield from _run_sequential(call, jobs, completion, options)
+        return
+
+    if cost is not None:
+        jobs = order_largest_first(jobs, cost)
+    if memory_budget is None:
+        memory_budget = get_default_memory_budget()
+    yield from _ParallelRun(call, jobs, completion, max_workers, memory_budget, options, io_workers).run()
+
+
+def _as_result(job, result, error):
+    """将工作进程本身的异常（如进程崩溃）也转为 CompressionResult"""
+    if error is None:
+        return result
+    return CompressionResult(job[0], job[1], error=f"{type(error).__name__}: {error}")
+
+
+def _resize_params(max_size, max_pixels):
+    """
+    生成追加在任务参数末尾的尺寸限制参数
+
+    不限制尺寸时不追加，任务参数（以及缓存、进度日志的键）与不支持尺寸限制时一致
+    """
+    if max_size is None and max_pixels is None:
+        return ()
+    return (max_size, max_pixels)
+
+
+def compress_batch_fixed_quality(
+    file_pairs, quality, max_workers=None, cache=None, stats=None, memory_budget=None,
+    report=None, journal=None, auto_format=False, max_size=None, max_pixels=None, io_workers=None, dedupe=None,
+):
+    """
+    批量固定质量压缩，大文件优先调度，按内存预算放行任务
+
+    Args:
+        file_pairs: [(input_path, output_path), ...]，输出路径的扩展名会替换为实际输出格式的扩展名
+        quality: JPEG质量 (1-100)，自动选择格式时也用于有损 WebP
+        max_workers: 工作进程数
+        cache: ResultCache 实例，None 表示不使用缓存
+        stats: 扫描时记录的 {path: (size, mtime_ns)}，用于估算任务代价
+        memory_budget: 内存预算（字节），默认使用物理内存的一半
+        report: RunReport 实例，None 表示不记录各阶段耗时
+        journal: Journal 实例，None 表示不记录进度
+        auto_format: 是否为每张图片自动选择 JPEG / WebP / PNG-8 中最小的格式
+        max_size: 最大尺寸 (宽, 高)，限制最长边时传入 (N, N)；None 表示不限制
+        max_pixels: 最大像素数，None 表示不限制
+        io_workers: 预读输入、写入输出的 I/O 线程数，None 表示由工作进程自行读写
+        dedupe: Deduplicator 实例，给出时内容相同的图片只压缩一次，None 表示不合并
+
+    Yields:
+        CompressionResult: 每张图片的压缩结果，按完成顺序
+    """
+    resize = _resize_params(max_size, max_pixels)
+    jobs = ((input_path, output_path, quality, *resize) for input_path, output_path in file_pairs)
+    cost = get_file_size_cost(stats)
+    func = compress_image_best_format if auto_format else compress_image_fixed_quality
+    for job, result, error in run_batch(
+        func, jobs, max_workers, cache, cost, memory_budget, report, journal, io_workers=io_workers, dedupe=dedupe
+    ):
+        yield _as_result(job, result, error)
+
+
+def _estimate_sizes(input_path, qualities, max_size=None, max_pixels=None):
+    """
+    估算质量-大小曲线，同时计算读入内容的哈希（输入只读取一次）
+
+    Returns:
+        tuple: (estimate_jpeg_sizes 的结果, 内容哈希)
+    """
+    with open(input_path, "rb") as f:
+        data = f.read()
+    return estimate_jpeg_sizes(input_path, qualities, max_size, max_pixels, source=data), hash_bytes(data)
+
+
+def plan_batch_to_size(
+    input_paths, total_size, max_workers=None, stats=None, max_size=None, max_pixels=None, cache=None
+):
+    """
+    并行估算每张图片的质量-大小曲线，并在总预算内分配目标大小
+
+    重新编码不会比原图小的图片按原图大小计入预算，省下的预算分给其余图片
+    （限制尺寸时原图不能直接使用，不做这项调整）。给出缓存时，大小和修改时间
+    未变的图片直接使用记录的曲线，不再解码
+
+    Args:
+        input_paths: 输入图片路径列表
+        total_size: 目标总大小（字节）
+        max_workers: 工作进程数
+        stats: 扫描时记录的 {path: (size, mtime_ns)}，用于获取原图大小
+        max_size: 压缩时的最大尺寸 (宽, 高)，None 表示不限制
+        max_pixels: 压缩时的最大像素数，None 表示不限制
+        cache: ResultCache 实例，记录并复用估算的曲线
+
+    Returns:
+        tuple: (target_sizes, quality)，与 input_paths 一一对应的目标大小列表，
+            以及规划出的统一质量（最低质量仍超出预算时为 None）
+    """
+    params = f"{estimate_jpeg_sizes.__name__}{(tuple(PLAN_QUALITIES), max_size, max_pixels)!r}"
+    curves = {}
+    if cache is not None:
+        for input_path in input_paths:
+            curves[input_path] = cache.lookup_curve(input_path, params)
+    jobs = (
+        (input_path, PLAN_QUALITIES, max_size, max_pixels)
+        for input_path in input_paths
+        if curves.get(input_path) is None
+    )
+    for job, estimated, error in run_batch(_estimate_sizes, jobs, max_workers):
+        if error is not None:
+            curves[job[0]] = None
+            continue
+        curves[job[0]], content_hash = estimated
+        if cache is not None:
+            cache.store_curve(job[0], params, content_hash, curves[job[0]])
+
+    input_sizes = None
+    if not _resize_params(max_size, max_pixels):
+        input_size = get_file_size_cost(stats)
+        input_sizes = [input_size((input_path,)) for input_path in input_paths]
+    return plan_target_sizes(
+        [curves[input_path] for input_path in input_paths],
+        total_size,
+        input_sizes=input_sizes,
+    )
+
+
+def compress_batch_to_size(
+    file_pairs, target_sizes, max_workers=None, cache=None, stats=None, memory_budget=None,
+    report=None, journal=None, max_size=None, max_pixels=None, io_workers=None, dedupe=None,
+):
+    """
+    批量目标大小压缩，大文件优先调度，按内存预算放行任务
+
+    随着图片陆续完成，在线拟合从图片特征到最终质量的回归模型，
+    后提交的图片以模型预测的质量作为搜索起点，同类图片通常只需编码一次
+
+    Args:
+        file_pairs: [(input_path, output_path), ...]
+        target_sizes: 与 file_pairs 一一对应的目标大小列表（字节）
+        max_workers: 工作进程数
+        cache: ResultCache 实例，None 表示不使用缓存
+        stats: 扫描时记录的 {path: (size, mtime_ns)}，用于估算任务代价
+        memory_budget: 内存预算（字节），默认使用物理内存的一半
+        report: RunReport 实例，None 表示不记录各阶段耗时
+        journal: Journal 实例，None 表示不记录进度
+        max_size: 最大尺寸 (宽, 高)，限制最长边时传入 (N, N)；None 表示不限制
+        max_pixels: 最大像素数，None 表示不限制
+        io_workers: 预读输入、写入输出的 I/O 线程数，None 表示由工作进程自行读写
+        dedupe: Deduplicator 实例，给出时内容相同的图片只压缩一次，None 表示不合并
+
+    Yields:
+        CompressionResult: 每张图片的压缩结果，按完成顺序
+    """
+    resize = _resize_params(max_size, max_pixels)
+    # 图片列表已完整，整体排序
+    jobs = [
+        (input_path, output_path, target_size, *resize)
+        for (input_path, output_path), target_size in zip(file_pairs, target_sizes)
+    ]
+    cost = get_file_size_cost(stats)
+    predictor = QualityPredictor()
+    for job, result, error in run_batch(
+        compress_image_to_size, jobs, max_workers, cache, cost, memory_budget, report, journal,
+        options=lambda job: {"predictor": predictor.snapshot()}, io_workers=io_workers, dedupe=dedupe,
+    ):
+        result = _as_result(job, result, error)
+        # 需要进一步缩小尺寸的图片不记录特征，其质量不反映特征与目标的关系
+        if result and result.features is not None and not result.kept_original:
+            predictor.observe(*result.features, result.quality)
+        yield result
+
+
+def compress_batch_renditions(file_pairs, renditions, max_workers=None, stats=None, memory_budget=None):
+    """
+    批量按多个规格输出，每张图片只解码一次，大文件优先调度，按内存预算放行任务
+
+    每张图片对应多个输出文件，不使用结果缓存和进度日志
+
+    Args:
+        file_pairs: [(input_path, output_path), ...]
+        renditions: [(max_size, quality, image_format, suffix), ...]，见 compress_image_renditions
+        max_workers: 工作进程数
+        stats: 扫描时记录的 {path: (size, mtime_ns)}，用于估算任务代价
+        memory_budget: 内存预算（字节），默认使用物理内存的一半
+
+    Yields:
+        list: 每张图片与 renditions 一一对应的 CompressionResult，按完成顺序
+    """
+    renditions = tuple(renditions)
+    jobs = ((input_path, output_path, renditions) for input_path, output_path in file_pairs)
+    cost = get_file_size_cost(stats)
+    for job, results, error in run_batch(
+        compress_image_renditions, jobs, max_workers, cost=cost, memory_budget=memory_budget
+    ):
+        if error is not None:
+            results = [_as_result(job, None, error) for _ in renditions]
+        yield results
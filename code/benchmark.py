@@ -0,0 +1,298 @@
+"""
+压缩性能基准测试
+生成可复现的合成图片集，对 compress_image_fixed_quality 和 compress_image_to_size
+分别计时，并与保存的基准结果对比
+
+用法:
+    python benchmark.py                          # 运行并打印结果
+    python benchmark.py --save baseline.json     # 保存为基准
+    python benchmark.py --baseline baseline.json # 与基准对比，出现退化时返回 1
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from compressors import compress_image_fixed_quality, compress_image_to_size
+from file_utils import format_size
+from metrics import get_peak_rss
+
+# 合成图片集的版本，生成方式改变时递增以重新生成
+CORPUS_VERSION = 1
+CORPUS_SEED = 20240601
+
+# 图片种类与像素数（百万像素）
+CORPUS_KINDS = ("photo", "graphics", "rgba", "palette")
+CORPUS_MEGAPIXELS = (1, 4, 12, 50)
+QUICK_MEGAPIXELS = (1, 4)
+
+# 固定质量模式的质量，目标大小模式按每像素字节数给出目标
+BENCH_QUALITY = 80
+BENCH_TARGET_BPP = 0.15
+
+# 数值越大越好的指标，其余指标越小越好
+HIGHER_IS_BETTER = ("images_per_s", "megapixels_per_s")
+COMPARED_METRICS = (
+    "images_per_s",
+    "megapixels_per_s",
+    "trial_encodes_per_image",
+    "probe_encodes_per_image",
+    "output_ratio",
+    "peak_rss",
+)
+
+
+def _image_size(megapixels):
+    """按 4:3 比例计算给定像素数的尺寸"""
+    height = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    return height * 4 // 3, height
+
+
+def _make_photo(rng, size):
+    """平滑渐变叠加噪点，近似照片（保存为 JPEG）"""
+    width, height = size
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    channels = [x * 180 + y * 40, y * 160 + 40, (1 - x) * 120 + y * 80]
+    base = np.stack(np.broadcast_arrays(*channels), axis=-1)
+    noise = rng.normal(0, 18, (height, width, 1)).astype(np.float32)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), "RGB")
+
+
+def _make_graphics(rng, size):
+    """纯色色块，近似截图和图表（保存为 PNG）"""
+    width, height = size
+    blocks = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    rows = np.arange(height) * 8 // height
+    columns = np.arange(width) * 8 // width
+    return Image.fromarray(blocks[rows][:, columns], "RGB")
+
+
+def _make_rgba(rng, size):
+    """带透明通道的图片（保存为 PNG）"""
+    img = _make_photo(rng, size).convert("RGBA")
+    width, height = size
+    alpha = np.linspace(0, 255, width, dtype=np.float32)[None, :].repeat(height, axis=0)
+    img.putalpha(Image.fromarray(alpha.astype(np.uint8), "L"))
+    return img
+
+
+def _make_palette(rng, size):
+    """调色板图片（保存为 PNG）"""
+    return _make_graphics(rng, size).quantize(colors=64)
+
+
+_GENERATORS = {
+    "photo": (_make_photo, ".jpg"),
+    "graphics": (_make_graphics, ".png"),
+    "rgba": (_make_rgba, ".png"),
+    "palette": (_make_palette, ".png"),
+}
+
+
+def generate_corpus(corpus_dir, megapixels=CORPUS_MEGAPIXELS):
+    """
+    生成合成图片集，已存在且版本一致的图片直接复用
+
+    Args:
+        corpus_dir: 图片集目录
+        megapixels: 要生成的像素数（百万像素）列表
+
+    Returns:
+        list: [(path, pixels), ...]
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = []
+    for mp in megapixels:
+        size = _image_size(mp)
+        for index, kind in enumerate(CORPUS_KINDS):
+            generator, extension = _GENERATORS[kind]
+            path = os.path.join(corpus_dir, f"v{CORPUS_VERSION}_{kind}_{mp}mp{extension}")
+            if not os.path.exists(path):
+                # 每张图片使用独立的种子，只生成部分图片时结果也一致
+                rng = np.random.default_rng((CORPUS_SEED, mp, index))
+                img = generator(rng, size)
+                if extension == ".jpg":
+                    img.save(path, quality=95)
+                else:
+                    img.save(path)
+            corpus.append((path, size[0] * size[1]))
+    return corpus
+
+
+def _run_mode(mode, corpus, output_dir):
+    """
+    在独立进程中用一种压缩方式处理整个图片集，内存峰值只反映本次运行
+
+    保留原图（重新编码不比原图小）和直接复用原图的图片没有编码，单独计数，
+    吞吐、编码次数和输出比例只统计实际编码输出的图片
+
+    Args:
+        mode: "fixed_quality" 或 "to_size"
+        corpus: [(path, pixels), ...]
+        output_dir: 输出目录
+
+    Returns:
+        dict: 本次运行的指标，没有实际编码输出的图片时编码相关指标为 None
+    """
+    input_bytes = output_bytes = pixels_total = trials = probes = failed = kept_original = passthrough = encoded = 0
+    encode_seconds = 0.0
+    start = time.perf_counter()
+    for path, pixels in corpus:
+        output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".jpg")
+        image_start = time.perf_counter()
+        if mode == "fixed_quality":
+            result = compress_image_fixed_quality(path, output_path, BENCH_QUALITY)
+        else:
+            result = compress_image_to_size(path, output_path, int(pixels * BENCH_TARGET_BPP))
+        if not result:
+            failed += 1
+        elif result.kept_original:
+            kept_original += 1
+        elif result.passthrough:
+            passthrough += 1
+        else:
+            encoded += 1
+            encode_seconds += time.perf_counter() - image_start
+            input_bytes += result.input_size
+            output_bytes += result.output_size
+            pixels_total += pixels
+            trials += result.trial_encodes
+            probes += result.probe_encodes
+    seconds = time.perf_counter() - start
+
+    return {
+        "images": len(corpus),
+        "failed": failed,
+        "kept_original": kept_original,
+        "passthrough": passthrough,
+        "encoded": encoded,
+        "seconds": seconds,
+        "images_per_s": encoded / encode_seconds if encoded else None,
+        "megapixels_per_s": pixels_total / 1_000_000 / encode_seconds if encoded else None,
+        "trial_encodes_per_image": trials / encoded if encoded else None,
+        "probe_encodes_per_image": probes / encoded if encoded else None,
+        "output_ratio": output_bytes / input_bytes if encoded else None,
+        "peak_rss": get_peak_rss(),
+    }
+
+
+def run_benchmark(corpus, output_dir):
+    """
+    依次运行两种压缩方式
+
+    Args:
+        corpus: [(path, pixels), ...]
+        output_dir: 输出目录
+
+    Returns:
+        dict: {mode: 指标}
+    """
+    results = {}
+    for mode in ("fixed_quality", "to_size"):
+        # 每种方式使用新的进程，避免内存峰值互相影响
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[mode] = executor.submit(_run_mode, mode, corpus, output_dir).result()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    与基准结果对比
+
+    Args:
+        results: run_benchmark 的结果
+        baseline: 基准结果
+        tolerance: 允许的相对退化比例
+
+    Returns:
+        list: 退化的指标描述
+    """
+    regressions = []
+    for mode, metrics in results.items():
+        previous_encoded = baseline.get(mode, {}).get("encoded")
+        if previous_encoded is not None and previous_encoded != metrics["encoded"]:
+            # 编码指标只统计实际编码的图片，张数不同时指标覆盖的图片也不同
+            print(f"  {mode:<14} 实际编码的图片数 {previous_encoded} → {metrics['encoded']}")
+        for name in COMPARED_METRICS:
+            current = metrics.get(name)
+            previous = baseline.get(mode, {}).get(name)
+            if current is None or not previous:
+                continue
+            change = (current - previous) / previous
+            worse = -change if name in HIGHER_IS_BETTER else change
+            mark = "⚠" if worse > tolerance else " "
+            print(f"{mark} {mode:<14} {name:<24} {previous:>14.4g} → {current:>14.4g} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append(f"{mode}.{name} {change:+.1%}")
+    return regressions
+
+
+def print_results(results):
+    """打印运行结果"""
+    for mode, metrics in results.items():
+        print(f"[{mode}]")
+        print(f"  图片数: {metrics['images']}（失败 {metrics['failed']}），耗时 {metrics['seconds']:.2f} 秒")
+        print(
+            f"  实际编码: {metrics['encoded']} 张，保留原图: {metrics['kept_original']} 张，"
+            f"直接复用原图: {metrics['passthrough']} 张"
+        )
+        if metrics["encoded"]:
+            print(
+                f"  {metrics['images_per_s']:.2f} 张/秒，{metrics['megapixels_per_s']:.2f} 百万像素/秒"
+                "（实际编码的图片）"
+            )
+            print(f"  平均编码次数: {metrics['trial_encodes_per_image']:.2f}")
+            print(f"  平均缩略图试编码次数: {metrics['probe_encodes_per_image']:.2f}")
+            print(f"  输出/输入大小: {metrics['output_ratio']:.3f}")
+        if metrics["peak_rss"] is not None:
+            print(f"  内存峰值: {format_size(metrics['peak_rss'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="压缩性能基准测试")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "image_compressor_corpus"),
+                        help="合成图片集目录（已生成的图片会被复用）")
+    parser.add_argument("--quick", action="store_true", help="只使用 1 和 4 百万像素的图片")
+    parser.add_argument("--baseline", help="与该基准 JSON 对比")
+    parser.add_argument("--save", help="将本次结果保存为基准 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的相对退化比例（默认 0.1）")
+    args = parser.parse_args(argv)
+
+    print("正在准备合成图片集...")
+    corpus = generate_corpus(args.corpus, QUICK_MEGAPIXELS if args.quick else CORPUS_MEGAPIXELS)
+
+    output_dir = tempfile.mkdtemp(prefix="image_compressor_bench_")
+    try:
+        results = run_benchmark(corpus, output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"已保存基准: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n与基准对比: {args.baseline}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n⚠ 性能退化: {', '.join(regressions)}")
+            return 1
+        print("\n✓ 未发现超出容差的退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
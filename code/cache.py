@@ -0,0 +1,343 @@
+"""
+压缩结果缓存模块
+以输入文件内容哈希和压缩参数为键记录压缩结果，重复运行时跳过未变化的图片；
+同时记录目标总大小模式估算的质量-大小曲线，重复运行时不再解码未变化的图片
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+from compressors import CompressionResult
+from file_utils import copy_file_atomic
+
+CACHE_FILENAME = ".compress_cache.sqlite"
+
+# 累计多少条新记录后提交一次，避免进程被强制结束时丢失全部记录
+COMMIT_INTERVAL = 100
+
+
+def make_params_key(kind, job):
+    """
+    生成压缩类型与参数的键
+
+    Args:
+        kind: 压缩类型（压缩函数名）
+        job: (input_path, output_path, *params)
+
+    Returns:
+        str: 参数键
+    """
+    return f"{kind}{tuple(job[2:])!r}"
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    计算文件内容哈希
+
+    Args:
+        path: 文件路径
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data):
+    """
+    计算已读入内存的文件内容的哈希，与 hash_file 的结果一致
+
+    Args:
+        data: 文件内容
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """压缩结果缓存（SQLite 文件，保存在输出目录中）"""
+
+    def __init__(self, output_dir, stats=None):
+        """
+        Args:
+            output_dir: 输出目录
+            stats: 扫描时记录的 {path: (size, mtime_ns)}，命中时不再 stat 输入文件
+        """
+        self.path = os.path.join(output_dir, CACHE_FILENAME)
+        self.stats = stats if stats is not None else {}
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._hashes = {}
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                input_path TEXT NOT NULL,
+                params TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                input_size INTEGER NOT NULL,
+                input_mtime_ns INTEGER NOT NULL,
+                output_path TEXT NOT NULL,
+                output_size INTEGER NOT NULL,
+                PRIMARY KEY (input_path, params)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_by_hash ON results (content_hash, params)"
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS curves (
+                input_path TEXT NOT NULL,
+                params TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                input_size INTEGER NOT NULL,
+                input_mtime_ns INTEGER NOT NULL,
+                curve TEXT NOT NULL,
+                PRIMARY KEY (input_path, params)
+            )
+            """
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """提交并关闭缓存"""
+        self.connection.commit()
+        self.connection.close()
+
+    def _input_stat(self, input_path):
+        """获取输入文件的 (size, mtime_ns)，优先使用扫描时记录的信息"""
+        stat = self.stats.get(input_path)
+        if stat is None:
+            result = os.stat(input_path)
+            stat = (result.st_size, result.st_mtime_ns)
+        return stat
+
+    def _recorded_hash(self, input_path, stat, params):
+        """文件大小和修改时间与记录一致时返回记录中的哈希，否则为 None"""
+        row = self.connection.execute(
+            "SELECT content_hash, input_size, input_mtime_ns FROM results WHERE input_path = ? AND params = ?",
+            (input_path, params),
+        ).fetchone()
+        if row is not None and (row[1], row[2]) == stat:
+            return row[0]
+        return None
+
+    def _content_hash(self, input_path, stat, params):
+        """
+        获取输入文件的内容哈希，文件大小和修改时间未变时直接沿用记录中的哈希
+        """
+        content_hash = self._recorded_hash(input_path, stat, params)
+        if content_hash is not None:
+            return content_hash
+        if input_path not in self._hashes:
+            self._hashes[input_path] = hash_file(input_path)
+        return self._hashes[input_path]
+
+    def needs_read(self, kind, job):
+        """
+        判断查找缓存前是否必须读取输入文件计算内容哈希
+
+        Args:
+            kind: 压缩类型（压缩函数名）
+            job: (input_path, output_path, *params)
+
+        Returns:
+            bool: 没有大小和修改时间与输入文件一致的记录时为 True
+        """
+        try:
+            stat = self._input_stat(job[0])
+        except OSError:
+            return True
+        return self._recorded_hash(job[0], stat, make_params_key(kind, job)) is None
+
+    def lookup(self, kind, job, content_hash=None):
+        """
+        查找可复用的压缩结果
+
+        只使用同一输入文件的记录：输出文件已存在且与记录一致时直接跳过，
+        输出路径改变时复制到本次的输出路径（扩展名沿用缓存中输出文件的扩展名，
+        与当时选中的输出格式一致）。其他输入中内容相同的输出由 find_output 查找，
+        交给 Deduplicator 硬链接并计为重复图片
+
+        Args:
+            kind: 压缩类型（压缩函数名）
+            job: (input_path, output_path, *params)
+            content_hash: 已从读入的内容计算出的哈希，给出时不再读取输入文件
+
+        Returns:
+            CompressionResult | None: 命中时返回复用的结果，否则为 None
+        """
+        input_path, output_path = job[0], job[1]
+        params = make_params_key(kind, job)
+        if content_hash is not None:
+            self._hashes[input_path] = content_hash
+        try:
+            stat = self._input_stat(input_path)
+            content_hash = self._content_hash(input_path, stat, params)
+        except OSError:
+            self.misses += 1
+            return None
+
+        row = self.connection.execute(
+            "SELECT output_path, output_size FROM results WHERE input_path = ? AND params = ? AND content_hash = ?",
+            (input_path, params, content_hash),
+        ).fetchone()
+        if row is not None:
+            cached_output_path, output_size = row
+            destination = os.path.splitext(output_path)[0] + os.path.splitext(cached_output_path)[1]
+            try:
+                available = os.path.getsize(cached_output_path) == output_size
+                if available and cached_output_path != destination:
+                    copy_file_atomic(cached_output_path, destination)
+            except OSError:
+                available = False
+            if available:
+                self._record(input_path, params, content_hash, stat, destination, output_size)
+                self.hits += 1
+                return CompressionResult(
+                    input_path, destination, input_size=stat[0], output_size=output_size, cached=True
+                )
+
+        self.misses += 1
+        return None
+
+    def find_output(self, kind, job, content_hash=None):
+        """
+        查找其他输入中内容相同、输出仍然存在的记录（输入被复制、移动或重命名后重新运行时）
+
+        Args:
+            kind: 压缩类型（压缩函数名）
+            job: (input_path, output_path, *params)
+            content_hash: 已从读入的内容计算出的哈希，给出时不再读取输入文件
+
+        Returns:
+            tuple | None: (output_path, output_size)，没有可用的输出时为 None
+        """
+        input_path = job[0]
+        params = make_params_key(kind, job)
+        try:
+            content_hash = content_hash or self._content_hash(input_path, self._input_stat(input_path), params)
+        except OSError:
+            return None
+
+        rows = self.connection.execute(
+            "SELECT output_path, output_size FROM results WHERE content_hash = ? AND params = ? AND input_path != ?",
+            (content_hash, params, input_path),
+        ).fetchall()
+        for output_path, output_size in rows:
+            try:
+                if os.path.getsize(output_path) == output_size:
+                    return output_path, output_size
+            except OSError:
+                continue
+        return None
+
+    def store(self, kind, job, output_size=None, output_path=None):
+        """
+        记录一次成功的压缩结果
+
+        Args:
+            kind: 压缩类型（压缩函数名）
+            job: (input_path, output_path, *params)
+            output_size: 输出文件大小（字节），None 时读取输出文件
+            output_path: 实际的输出路径（扩展名可能已按输出格式替换），None 时使用 job 中的路径
+        """
+        input_path = job[0]
+        output_path = output_path or job[1]
+        params = make_params_key(kind, job)
+        try:
+            stat = self._input_stat(input_path)
+            content_hash = self._content_hash(input_path, stat, params)
+            if output_size is None:
+                output_size = os.path.getsize(output_path)
+        except OSError:
+            return
+        self._record(input_path, params, content_hash, stat, output_path, output_size)
+
+    def _record(self, input_path, params, content_hash, stat, output_path, output_size):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (input_path, params, content_hash, stat[0], stat[1], output_path, output_size),
+        )
+        self._hashes.pop(input_path, None)
+        self._count_uncommitted()
+
+    def _count_uncommitted(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self._uncommitted = 0
+
+    def lookup_curve(self, input_path, params):
+        """
+        查找估算过的质量-大小曲线，输入文件大小和修改时间与记录一致时才使用（不读取输入文件）
+
+        Args:
+            input_path: 输入图片路径
+            params: 估算参数的键（质量列表和尺寸限制）
+
+        Returns:
+            list | None: [(quality, estimated_size), ...]，没有可用的记录时为 None
+        """
+        try:
+            stat = self._input_stat(input_path)
+        except OSError:
+            return None
+        row = self.connection.execute(
+            "SELECT content_hash, input_size, input_mtime_ns, curve FROM curves WHERE input_path = ? AND params = ?",
+            (input_path, params),
+        ).fetchone()
+        if row is None or (row[1], row[2]) != stat:
+            return None
+        # 随后的压缩查找缓存时不必再读取输入文件计算哈希
+        self._hashes.setdefault(input_path, row[0])
+        return [tuple(point) for point in json.loads(row[3])]
+
+    def store_curve(self, input_path, params, content_hash, curve):
+        """
+        记录估算的质量-大小曲线
+
+        Args:
+            input_path: 输入图片路径
+            params: 估算参数的键（质量列表和尺寸限制）
+            content_hash: 估算时读入的内容的哈希
+            curve: [(quality, estimated_size), ...]
+        """
+        try:
+            stat = self._input_stat(input_path)
+        except OSError:
+            return
+        self.connection.execute(
+            "INSERT OR REPLACE INTO curves VALUES (?, ?, ?, ?, ?, ?)",
+            (input_path, params, content_hash, stat[0], stat[1], json.dumps(curve)),
+        )
+        self._hashes.setdefault(input_path, content_hash)
+        self._count_uncommitted()
+
+    def hit_rate(self):
+        """
+        获取缓存命中率
+
+        Returns:
+            float: 命中率 (0-1)，没有查询时为 0
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -1,13 +1,49 @@
 """
 命令行界面模块
+不带参数时逐项询问（交互模式），带参数时按参数直接运行（适合脚本和定时任务）
 """
+import argparse
 import os
-from compressors import compress_image_fixed_quality, compress_image_to_size
-from file_utils import get_image_files, get_output_path, format_size
+import sys
 
+from batch import compress_batch_fixed_quality, compress_batch_to_size, get_default_workers, plan_batch_to_size
+from cache import ResultCache
+from dedupe import Deduplicator
+from file_utils import ImageScanner, format_size, iter_file_pairs
+from journal import Journal
+from metrics import RunReport
 
-def main():
-    """命令行主函数"""
+# 退出码
+EXIT_OK = 0
+EXIT_FAILED = 1  # 部分图片压缩失败或发生错误
+EXIT_USAGE = 2  # 参数错误（与 argparse 一致）
+EXIT_NO_IMAGES = 3  # 未找到任何图片
+EXIT_OVER_BUDGET = 4  # 目标大小模式下超出目标总大小
+EXIT_CANCELLED = 130  # 用户中断
+
+
+def get_default_output_dir(input_path):
+    """
+    获取默认输出目录
+
+    Args:
+        input_path: 输入路径（文件夹或单张图片）
+
+    Returns:
+        str: 输入目录下的 compressed 文件夹
+    """
+    if os.path.isfile(input_path):
+        return os.path.join(os.path.dirname(input_path), "compressed")
+    return os.path.join(input_path, "compressed")
+
+
+def interactive():
+    """
+    交互模式：逐项询问参数后开始压缩
+
+    Returns:
+        int: 退出码
+    """
     print("=" * 50)
     print("图片压缩工具 (CLI模式)")
     print("=" * 50)
@@ -24,12 +60,7 @@ def main():
     print()
     output_dir = input("请输入输出目录（直接回车使用默认: 输入目录/compressed）: ").strip().strip('"')
     if not output_dir:
-        if os.path.isfile(input_path):
-            output_dir = os.path.join(os.path.dirname(input_path), "compressed")
-        else:
-            output_dir = os.path.join(input_path, "compressed")
-    
-    os.makedirs(output_dir, exist_ok=True)
+        output_dir = get_default_output_dir(input_path)
     
     # 3. 选择压缩模式
     print()
@@ -43,6 +74,8 @@ def main():
         print("❌ 请输入 1 或 2！")
     
     quality = 85  # 默认质量
+    total_max_size = None
+    auto_format = False
     if mode == "1":
         # 固定质量模式
         print()
@@ -58,6 +91,12 @@ def main():
                 print("❌ 质量值必须在 1-100 之间！")
             except ValueError:
                 print("❌ 请输入有效的数字！")
+        
+        print()
+        print("请选择输出格式：")
+        print("1. JPEG（默认）")
+        print("2. 自动选择（JPEG / WebP / PNG-8 中最小的，适合截图和图形）")
+        auto_format = input("请选择 (1 或 2，直接回车使用1): ").strip() == "2"
     else:
         # 目标大小模式
         print()
@@ -75,66 +114,214 @@ def main():
             except ValueError:
                 print("❌ 请输入有效的数字！")
     
-    # 获取图片文件列表
+    # 4. 选择并行进程数
     print()
-    print("正在扫描图片文件...")
-    image_files = get_image_files(input_path)
+    default_workers = get_default_workers()
+    while True:
+        try:
+            workers_input = input(f"请输入并行进程数（直接回车使用{default_workers}）: ").strip()
+            if not workers_input:
+                workers = default_workers
+                break
+            workers = int(workers_input)
+            if workers >= 1:
+                break
+            print("❌ 进程数必须大于等于 1！")
+        except ValueError:
+            print("❌ 请输入有效的数字！")
     
-    if not image_files:
-        print("❌ 未找到任何图片文件！")
-        return
+    # 5. 尺寸限制（超出时等比缩小）
+    print()
+    max_size = None
+    while True:
+        try:
+            edge_input = input("请输入最长边上限（像素，如 2560，直接回车不限制）: ").strip()
+            if not edge_input:
+                break
+            max_edge = int(edge_input)
+            if max_edge >= 1:
+                max_size = (max_edge, max_edge)
+                break
+            print("❌ 最长边必须大于等于 1！")
+        except ValueError:
+            print("❌ 请输入有效的数字！")
     
-    print(f"找到 {len(image_files)} 张图片")
+    max_pixels = None
+    while True:
+        try:
+            megapixels_input = input("请输入像素数上限（百万像素，如 12，直接回车不限制）: ").strip()
+            if not megapixels_input:
+                break
+            megapixels = float(megapixels_input)
+            if megapixels > 0:
+                max_pixels = int(megapixels * 1_000_000)
+                break
+            print("❌ 像素数必须大于 0！")
+        except ValueError:
+            print("❌ 请输入有效的数字！")
+    
+    # 6. 上次运行被中断时，询问是否继续
+    resume = False
+    if Journal.exists(output_dir):
+        print()
+        resume = input("检测到上次未完成的进度，是否跳过已完成的图片？(Y/n): ").strip().lower() != "n"
+    
+    if mode == "2":
+        quality = None
+    return compress(
+        input_path, output_dir, quality, total_max_size, workers,
+        resume=resume, auto_format=auto_format, max_size=max_size, max_pixels=max_pixels,
+    )
+
+
+def compress(
+    input_path, output_dir, quality=None, total_max_size=None, workers=None, report_path=None, resume=False,
+    auto_format=False, max_size=None, max_pixels=None, io_workers=None, deduplicate=True,
+):
+    """
+    扫描并批量压缩图片
+
+    Args:
+        input_path: 输入路径（文件夹或单张图片）
+        output_dir: 输出目录
+        quality: 固定质量模式的 JPEG 质量，None 时使用目标大小模式
+        total_max_size: 目标大小模式的目标总大小（字节）
+        workers: 并行进程数，None 表示使用 CPU 核心数
+        report_path: 运行报告（JSON）的保存路径，None 表示不生成
+        resume: 是否跳过上次运行（被中断）中已完成的图片
+        auto_format: 固定质量模式下是否为每张图片自动选择最小的输出格式
+        max_size: 最大尺寸 (宽, 高)，超出时等比缩小，None 表示不限制
+        max_pixels: 最大像素数，超出时等比缩小，None 表示不限制
+        io_workers: 预读输入、写入输出的 I/O 线程数，None 表示由压缩进程自行读写
+        deduplicate: 是否只压缩内容相同的图片中的一张，其余硬链接（或复制）其输出
+
+    Returns:
+        int: 退出码
+    """
+    mode = "1" if quality is not None else "2"
+    workers = workers or get_default_workers()
+    os.makedirs(output_dir, exist_ok=True)
+    report = RunReport() if report_path else None
+
+    # 扫描图片文件（后台线程扫描，固定质量模式边扫描边压缩）
     print()
+    scanner = ImageScanner(input_path, output_dir)
+    if mode == "2":
+        # 目标大小模式需要先知道全部图片才能分配预算
+        print("正在扫描图片文件...")
+        image_files = list(scanner)
+        
+        if not image_files:
+            print("❌ 未找到任何图片文件！")
+            return EXIT_NO_IMAGES
+        
+        print(f"找到 {len(image_files)} 张图片")
+        print()
+    else:
+        image_files = scanner
     
     # 开始压缩
+    file_pairs = iter_file_pairs(image_files, input_path, output_dir)
+    
+    # 以内容哈希和压缩参数为键的结果缓存，重复运行时跳过未变化的图片
+    cache = ResultCache(output_dir, scanner.stats)
+    
+    # 每完成一张图片追加一条进度记录，中断后可从上次的进度继续
+    journal = Journal(output_dir, resume, scanner.stats)
+    
+    # 按 (文件大小, 内容哈希) 合并重复的输入，每组只压缩一张
+    dedupe = Deduplicator(scanner.stats) if deduplicate else None
+    
     total_size = 0
     success_count = 0
     fail_count = 0
+    passthrough_count = 0
+    kept_count = 0
     
-    if mode == "1":
-        # 固定质量模式
-        print(f"开始压缩（质量: {quality}）...")
-        print("-" * 50)
-        for root, file in image_files:
-            input_file_path = os.path.join(root, file)
-            output_file_path = get_output_path(input_file_path, input_path, output_dir)
-            
-            try:
-                if compress_image_fixed_quality(input_file_path, output_file_path, quality):
-                    size = os.path.getsize(output_file_path)
+    try:
+        if mode == "1":
+            # 固定质量模式
+            format_label = "，自动选择格式" if auto_format else ""
+            print(f"开始压缩（质量: {quality}{format_label}，进程数: {workers}）...")
+            print("-" * 50)
+            results = compress_batch_fixed_quality(
+                file_pairs, quality, workers, cache, scanner.stats, report=report, journal=journal,
+                auto_format=auto_format, max_size=max_size, max_pixels=max_pixels, io_workers=io_workers,
+                dedupe=dedupe,
+            )
+            for result in results:
+                file = os.path.basename(result.input_path)
+                if result:
+                    size = result.output_size
                     total_size += size
                     success_count += 1
-                    print(f"✔ [{success_count}/{len(image_files)}] {file} → {format_size(size)}")
+                    passthrough_count += result.passthrough
+                    kept_count += result.kept_original
+                    note = ""
+                    if result.passthrough:
+                        note = "（原图质量已不高于要求，直接复用）"
+                    elif result.kept_original:
+                        note = "（重新编码不比原图小，保留原图）"
+                    elif result.deduplicated:
+                        note = "（与其他图片内容相同，共用其输出）"
+                    output_file = os.path.basename(result.output_path)
+                    if output_file != file:
+                        note = f" ({output_file}){note}"
+                    print(f"✔ [{success_count}/{scanner.total_label()}] {file} → {format_size(size)}{note}")
                 else:
                     fail_count += 1
-                    print(f"✖ {file} 压缩失败")
-            except Exception as e:
-                fail_count += 1
-                print(f"✖ {file} 压缩失败: {e}")
-    else:
-        # 目标大小模式
-        target_size_per_image = total_max_size // len(image_files)
-        print(f"目标总大小: {format_size(total_max_size)}")
-        print(f"平均每张目标大小: {format_size(target_size_per_image)}")
-        print("-" * 50)
+                    print(f"✖ {file} 压缩失败: {result.error}")
+        else:
+            # 目标大小模式
+            print(f"目标总大小: {format_size(total_max_size)}")
+            print("正在分析图片，分配每张图片的目标大小...")
+            input_paths = [os.path.join(root, file) for root, file in image_files]
+            target_sizes, planned_quality = plan_batch_to_size(
+                input_paths, total_max_size, workers, scanner.stats, max_size, max_pixels, cache
+            )
+            if planned_quality is not None:
+                print(f"预估统一质量: {planned_quality}")
+            else:
+                print("⚠ 预算不足，部分图片将缩小尺寸")
+            print("-" * 50)
         
-        for root, file in image_files:
-            input_file_path = os.path.join(root, file)
-            output_file_path = get_output_path(input_file_path, input_path, output_dir)
-            
-            try:
-                if compress_image_to_size(input_file_path, output_file_path, target_size_per_image):
-                    size = os.path.getsize(output_file_path)
+            results = compress_batch_to_size(
+                file_pairs, target_sizes, workers, cache, scanner.stats, report=report, journal=journal,
+                max_size=max_size, max_pixels=max_pixels, io_workers=io_workers,
+                dedupe=dedupe,
+            )
+            for result in results:
+                file = os.path.basename(result.input_path)
+                if result:
+                    size = result.output_size
                     total_size += size
                     success_count += 1
-                    print(f"✔ [{success_count}/{len(image_files)}] {file} → {format_size(size)} (累计: {format_size(total_size)})")
+                    kept_count += result.kept_original
+                    note = "（保留原图）" if result.kept_original else ""
+                    if result.deduplicated:
+                        note = "（内容重复，共用输出）"
+                    print(
+                        f"✔ [{success_count}/{len(image_files)}] {file} → {format_size(size)} "
+                        f"(累计: {format_size(total_size)}){note}"
+                    )
                 else:
                     fail_count += 1
-                    print(f"✖ {file} 压缩失败")
-            except Exception as e:
-                fail_count += 1
-                print(f"✖ {file} 压缩失败: {e}")
+                    print(f"✖ {file} 压缩失败: {result.error}")
+    finally:
+        # 中断时也保存缓存，进度日志中已写入的记录可用于 --resume
+        cache.close()
+        journal.close()
+    
+    if fail_count == 0:
+        # 全部完成，下次运行无需继续
+        journal.discard()
+    
+    if scanner.count == 0:
+        print("❌ 未找到任何图片文件！")
+        return EXIT_NO_IMAGES
+    
+    if report is not None:
+        report.write(report_path)
     
     # 输出结果
     print("-" * 50)
@@ -143,7 +330,18 @@ def main():
     if fail_count > 0:
         print(f"失败: {fail_count} 张")
     print(f"总大小: {format_size(total_size)}")
+    print(f"缓存命中: {cache.hits}/{cache.hits + cache.misses} ({cache.hit_rate():.1%})")
+    if passthrough_count:
+        print(f"直接复用原图: {passthrough_count} 张")
+    if kept_count:
+        print(f"保留原图（重新编码不比原图小）: {kept_count} 张")
+    if dedupe is not None and dedupe.duplicates:
+        print(f"重复图片: {dedupe.duplicates}/{dedupe.inputs} 张，共用输出（去重率 {dedupe.ratio():.1%}）")
+    if journal.resumed:
+        print(f"跳过上次已完成: {journal.resumed} 张")
     print(f"输出目录: {output_dir}")
+    if report is not None:
+        print(f"运行报告: {report_path}")
     
     if mode == "2":
         if total_size <= total_max_size:
@@ -151,14 +349,111 @@ def main():
         else:
             overflow = total_size - total_max_size
             print(f"⚠ 超出目标大小 {format_size(overflow)}")
+            return EXIT_OVER_BUDGET
+    
+    return EXIT_FAILED if fail_count > 0 else EXIT_OK
 
 
-if __name__ == "__main__":
+def parse_args(argv):
+    """
+    解析命令行参数
+
+    Args:
+        argv: 参数列表（不含程序名）
+
+    Returns:
+        argparse.Namespace: 解析结果
+    """
+    parser = argparse.ArgumentParser(
+        description="图片批量压缩（非交互模式）",
+        epilog="退出码: 0 成功，1 部分图片失败，2 参数错误，3 未找到图片，4 超出目标总大小",
+    )
+    parser.add_argument("--input", required=True, help="图片路径（文件夹或单张图片）")
+    parser.add_argument("--output", help="输出目录（默认: 输入目录/compressed）")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--quality", type=int, help="固定质量压缩的 JPEG 质量 (1-100，默认 85)")
+    mode.add_argument("--target-total", type=float, help="目标大小压缩的目标总大小（MB）")
+    parser.add_argument("--format", choices=("jpeg", "auto"), default="jpeg",
+                        help="输出格式：jpeg，或 auto 为每张图片选择 JPEG / WebP / PNG-8 中最小的（仅固定质量模式）")
+    parser.add_argument("--max-edge", type=int, help="最长边上限（像素），超出时等比缩小")
+    parser.add_argument("--max-megapixels", type=float, help="像素数上限（百万像素），超出时等比缩小")
+    parser.add_argument("--jobs", type=int, help="并行进程数（默认: CPU 核心数）")
+    parser.add_argument("--io-jobs", type=int,
+                        help="预读输入、写入输出的 I/O 线程数，适合网络存储（默认: 由压缩进程自行读写）")
+    parser.add_argument("--no-dedupe", action="store_true", help="不合并内容相同的图片，每张都单独压缩")
+    parser.add_argument("--report", help="将运行报告（各阶段耗时、编码次数、内存峰值）保存为 JSON")
+    parser.add_argument("--resume", action="store_true", help="跳过上次运行（被中断）中已完成的图片")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.input):
+        parser.error(f"路径不存在: {args.input}")
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        parser.error("--quality 必须在 1-100 之间")
+    if args.target_total is not None and args.target_total <= 0:
+        parser.error("--target-total 必须大于 0")
+    if args.format == "auto" and args.target_total is not None:
+        parser.error("--format auto 只能用于固定质量模式")
+    if args.max_edge is not None and args.max_edge < 1:
+        parser.error("--max-edge 必须大于等于 1")
+    if args.max_megapixels is not None and args.max_megapixels <= 0:
+        parser.error("--max-megapixels 必须大于 0")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs 必须大于等于 1")
+    if args.io_jobs is not None and args.io_jobs < 1:
+        parser.error("--io-jobs 必须大于等于 1")
+    if args.quality is None and args.target_total is None:
+        args.quality = 85
+    return args
+
+
+def main(argv=None):
+    """
+    命令行主函数，python cli.py 与 python main.py --cli 共用
+
+    Args:
+        argv: 参数列表（不含程序名），None 表示使用 sys.argv；为空时进入交互模式
+
+    Returns:
+        int: 退出码，用户取消时为 EXIT_CANCELLED，发生未处理的错误时为 EXIT_FAILED
+    """
+    if argv is None:
+        argv = sys.argv[1:]
     try:
-        main()
+        return _run(argv)
     except KeyboardInterrupt:
         print("\n\n程序已取消")
+        return EXIT_CANCELLED
     except Exception as e:
         print(f"\n❌ 发生错误: {e}")
-        input("\n按回车键退出...")
+        # 非交互模式下没有人在终端前等待
+        if not argv:
+            input("\n按回车键退出...")
+        return EXIT_FAILED
+
+
+def _run(argv):
+    if not argv:
+        return interactive()
 
+    args = parse_args(argv)
+    total_max_size = None
+    if args.target_total is not None:
+        total_max_size = int(args.target_total * 1024 * 1024)
+    return compress(
+        args.input,
+        args.output or get_default_output_dir(args.input),
+        args.quality if total_max_size is None else None,
+        total_max_size,
+        args.jobs,
+        args.report,
+        args.resume,
+        args.format == "auto",
+        (args.max_edge, args.max_edge) if args.max_edge else None,
+        int(args.max_megapixels * 1_000_000) if args.max_megapixels else None,
+        args.io_jobs,
+        not args.no_dedupe,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,98 +1,1076 @@
 """
 图片压缩核心功能模块
 """
+import io
+import math
 import os
+import time
+
+import numpy as np
+from file_utils import link_or_copy_atomic, write_file_atomic
+from metrics import count_probe_encode, count_trial_encode, stage
 from PIL import Image
+from predictor import predict_quality
+
+# 目标大小模式的质量搜索范围
+MIN_QUALITY = 15
+MAX_QUALITY = 95
+
+# 质量预测模型使用的缩略图尺寸、拼贴小块边长与采样质量
+PROBE_SIZE = (512, 512)
+PROBE_TILE = 128
+PROBE_QUALITIES = (15, 35, 55, 75, 95)
+
+# 各输出格式的扩展名，第一个为默认扩展名
+FORMAT_EXTENSIONS = {
+    "JPEG": (".jpg", ".jpeg"),
+    "WEBP": (".webp",),
+    "PNG": (".png",),
+}
+
+# 缩小尺寸时先用 Image.reduce 按整数倍缩小，只保留不足该倍数的部分给 LANCZOS
+REDUCING_GAP = 2.0
+
+# 按跨图片预测的质量编码后，大小与目标的对数差在该范围内时才检查相邻质量
+HINT_NEIGHBOR_RANGE = 0.1
+
+# 自动选择格式（以及计算质量预测特征）时分析用缩略图的边长
+ANALYSIS_SIZE = 256
+
+# 缩略图颜色数不超过该值时视为图形（截图、图表、图标），优先无损格式
+GRAPHIC_MAX_COLORS = 256
+
+# 灰度图最多只有 256 级，灰度级数不超过该值时才视为图形
+GRAY_GRAPHIC_MAX_LEVELS = 64
+
+# 相邻像素相同的比例超过该值时视为大面积纯色，PNG-8 可能更小
+FLAT_RATIO = 0.5
+
+# JPEG 标准（IJG）亮度量化表，按行优先顺序
+STANDARD_LUMINANCE_TABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+
+class CompressionResult:
+    """单张图片的压缩结果，布尔值表示是否成功"""
+
+    def __init__(
+        self,
+        input_path,
+        output_path,
+        input_size=None,
+        output_size=None,
+        quality=None,
+        scale=1.0,
+        trial_encodes=0,
+        probe_encodes=0,
+        elapsed=0.0,
+        error=None,
+        cached=False,
+        passthrough=False,
+        kept_original=False,
+        features=None,
+        data=None,
+        deduplicated=False,
+    ):
+        """
+        Args:
+            input_path: 输入图片路径
+            output_path: 输出图片路径
+            input_size: 输入文件大小（字节）
+            output_size: 输出文件大小（字节），失败时为 None
+            quality: 最终使用的 JPEG 质量
+            scale: 输出宽度与原图宽度之比（包括 max_size/max_pixels 限制的缩小）
+            trial_encodes: 编码次数（包括写入的那次）
+            probe_encodes: 拟合质量模型时缩略图的试编码次数（不计入 trial_encodes）
+            elapsed: 耗时（秒）
+            error: 失败原因，成功时为 None
+            cached: 是否直接复用了缓存中的结果
+            passthrough: 是否直接复用了原图（原图质量已不高于要求的质量）
+            kept_original: 是否保留了原图（重新编码后反而更大）
+            features: 目标大小模式下用于跨图片质量预测的 (原图格式, 特征)，未计算时为 None
+            data: 延后写入时尚未写入磁盘的编码数据，已写入或无需写入时为 None
+            deduplicated: 是否与另一张内容相同的图片共用了其输出（未单独压缩）
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.input_size = input_size
+        self.output_size = output_size
+        self.quality = quality
+        self.scale = scale
+        self.trial_encodes = trial_encodes
+        self.probe_encodes = probe_encodes
+        self.elapsed = elapsed
+        self.error = error
+        self.cached = cached
+        self.passthrough = passthrough
+        self.kept_original = kept_original
+        self.features = features
+        self.data = data
+        self.deduplicated = deduplicated
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        if not self.success:
+            return f"CompressionResult({self.input_path!r}, error={self.error!r})"
+        return (
+            f"CompressionResult({self.input_path!r}, {self.input_size} -> {self.output_size}, "
+            f"quality={self.quality}, scale={self.scale})"
+        )
+
 
+def _describe_error(error):
+    """将异常转为便于显示的描述（异常对象不一定能跨进程传递）"""
+    return f"{type(error).__name__}: {error}"
 
-def compress_image_fixed_quality(input_path, output_path, quality):
+
+def _fit_size(size, max_size=None, max_pixels=None):
+    """
+    计算等比缩放到最大尺寸和最大像素数以内后的尺寸
+
+    Args:
+        size: 原始尺寸 (宽, 高)
+        max_size: 最大尺寸 (宽, 高)，限制最长边时传入 (N, N)；None 表示不限制
+        max_pixels: 最大像素数，None 表示不限制
+
+    Returns:
+        tuple: 缩放后的尺寸 (宽, 高)，不会超过原始尺寸
+    """
+    width, height = size
+    scale = 1.0
+    if max_size is not None:
+        scale = min(scale, max_size[0] / width, max_size[1] / height)
+    if max_pixels is not None:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _has_transparency(img):
+    """判断图片是否带有透明信息（Alpha 通道或调色板 / tRNS 透明色）"""
+    return img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+
+
+def _open_rgb(input_path, max_size=None, max_pixels=None, keep_alpha=False):
+    """
+    打开并解码图片为 RGB，可选地限制最大尺寸和最大像素数
+
+    目标尺寸不超过原图一半时，JPEG 解码器通过 draft 模式直接在 DCT 域
+    以 1/2、1/4 或 1/8 分辨率解码；其他格式先用 Image.reduce 按整数倍缩小，
+    最后再用 LANCZOS 缩放到精确尺寸
+
+    Args:
+        input_path: 输入图片路径或已打开的文件对象
+        max_size: 最大尺寸 (宽, 高)，None 表示不限制
+        max_pixels: 最大像素数，None 表示不限制
+        keep_alpha: 是否保留透明度：图片确实有透明像素时返回 RGBA，否则仍转为 RGB
+
+    Returns:
+        Image: 已解码的 RGB 图片（灰度、黑白和 16 位灰度图为 L，keep_alpha 时可能为 RGBA）
+    """
+    with stage("decode"):
+        img = Image.open(input_path)
+
+        target_size = None
+        if max_size is not None or max_pixels is not None:
+            target_size = _fit_size(img.size, max_size, max_pixels)
+            if target_size == img.size:
+                target_size = None
+            else:
+                # 非 JPEG 格式或缩放比例不足一半时 draft 不会生效
+                img.draft("RGB", target_size)
+
+        img.load()
+
+    if keep_alpha and _has_transparency(img):
+        with stage("convert"):
+            img = img.convert("RGBA")
+            # Alpha 通道全不透明时与 RGB 无异
+            if img.getchannel("A").getextrema()[0] == 255:
+                img = img.convert("RGB")
+    elif img.mode.startswith("I"):
+        # 16 位灰度（I;16 / I）直接 convert 会截断为全白，按 0-65535 的范围缩放到 8 位
+        with stage("convert"):
+            img = Image.fromarray((np.asarray(img, dtype=np.uint32) >> 8).astype(np.uint8), "L")
+    # 除灰度外统一转 RGB（包括 CMYK、YCbCr 等模式），各编码器都能处理；黑白图转灰度
+    elif img.mode not in ("RGB", "L"):
+        with stage("convert"):
+            img = img.convert("L" if img.mode == "1" else "RGB")
+
+    if target_size is not None and img.size != target_size:
+        with stage("resize"):
+            img = _resize(img, target_size)
+
+    return img
+
+
+def _resize(img, size):
+    """用 LANCZOS 缩放图片，RGBA 在预乘 Alpha 下缩放，避免透明像素的颜色渗到边缘"""
+    if img.mode == "RGBA":
+        return img.convert("RGBa").resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP).convert("RGBA")
+    return img.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def _scaled_quantization_table(quality):
+    """按 IJG 的质量缩放规则计算给定质量下的亮度量化表"""
+    scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+    return [min(max((value * scale + 50) // 100, 1), 255) for value in STANDARD_LUMINANCE_TABLE]
+
+
+def estimate_jpeg_quality(img):
+    """
+    根据亮度量化表估算 JPEG 的保存质量
+
+    与按 IJG 规则缩放的标准量化表逐项比较，取最接近的质量。
+    使用自定义量化表的编码器（如部分相机）只能得到近似值
+
+    Args:
+        img: 已打开（无需解码）的图片
+
+    Returns:
+        int | None: 估算的质量 (1-100)，不是 JPEG 或没有量化表时为 None
+    """
+    tables = getattr(img, "quantization", None)
+    if img.format != "JPEG" or not tables or 0 not in tables or len(tables[0]) != 64:
+        return None
+    table = list(tables[0])
+    return min(
+        range(1, 101),
+        key=lambda quality: sum(abs(a - b) for a, b in zip(_scaled_quantization_table(quality), table)),
+    )
+
+
+def _output_path_for(output_path, image_format):
+    """
+    将输出路径的扩展名替换为实际输出格式的扩展名
+
+    Args:
+        output_path: 输出路径（带原图扩展名）
+        image_format: 实际输出格式（Pillow 格式名）
+
+    Returns:
+        str: 扩展名已与格式一致（如 .jpeg）或格式未知时原样返回
+    """
+    base, extension = os.path.splitext(output_path)
+    extensions = FORMAT_EXTENSIONS.get(image_format)
+    if extensions is None or extension.lower() in extensions:
+        return output_path
+    return base + extensions[0]
+
+
+def _needs_resize(img, max_size, max_pixels=None):
+    """判断图片是否超出最大尺寸或最大像素数、需要缩小"""
+    return _fit_size(img.size, max_size, max_pixels) != img.size
+
+
+def _can_pass_through(img, quality, max_size, max_pixels=None):
+    """
+    判断原图能否直接作为输出：原图是质量不高于要求的 JPEG，且无需缩放
+
+    Returns:
+        int | None: 原图的估算质量，不能直接使用时为 None
+    """
+    if _needs_resize(img, max_size, max_pixels):
+        return None
+    source_quality = estimate_jpeg_quality(img)
+    if source_quality is None or source_quality > quality:
+        return None
+    return source_quality
+
+
+def _open_input(input_path, source=None):
+    """
+    打开输入图片
+
+    Args:
+        input_path: 输入图片路径
+        source: 已预读的文件内容，给出时从内存读取，不再访问磁盘
+
+    Returns:
+        tuple: (文件对象, 文件大小)
+    """
+    if source is not None:
+        return io.BytesIO(source), len(source)
+    # 通过已打开的文件获取大小，不再单独 stat
+    f = open(input_path, "rb")
+    return f, os.fstat(f.fileno()).st_size
+
+
+def _write_output(result, data, defer_write=False):
+    """写入编码数据；延后写入时只记录在结果中，由 write_deferred 写入"""
+    if defer_write:
+        result.data = data
+    else:
+        with stage("write"):
+            write_file_atomic(result.output_path, data)
+    result.output_size = len(data)
+
+
+def _link_original(result, defer_write=False):
+    """将原图硬链接（或复制）为输出；延后写入时由 write_deferred 完成"""
+    if not defer_write:
+        with stage("write"):
+            link_or_copy_atomic(result.input_path, result.output_path)
+    result.output_size = result.input_size
+
+
+def write_deferred(result):
+    """
+    完成延后的写入：写入编码数据，或将复用、保留的原图链接为输出
+
+    Args:
+        result: 以 defer_write=True 压缩得到的 CompressionResult，失败的结果不做任何事
+
+    Returns:
+        CompressionResult: 同一个结果，写入失败时记录失败原因
+    """
+    if not result:
+        return result
+    try:
+        if result.data is not None:
+            write_file_atomic(result.output_path, result.data)
+        elif result.passthrough or result.kept_original:
+            link_or_copy_atomic(result.input_path, result.output_path)
+    except Exception as e:
+        result.error = _describe_error(e)
+    result.data = None
+    return result
+
+
+def _keep_original(result, source_format, defer_write=False):
+    """将原图硬链接（或复制）为输出，用于重新编码无法变小的情况"""
+    result.output_path = _output_path_for(result.output_path, source_format)
+    _link_original(result, defer_write)
+    result.quality = None
+    result.kept_original = True
+
+
+def compress_image_fixed_quality(
+    input_path, output_path, quality, max_size=None, max_pixels=None, source=None, defer_write=False
+):
     """
     使用固定质量压缩图片
+
+    原图已经是质量不高于要求的 JPEG 时，重新编码只会让画质更差、体积也未必更小，
+    此时直接将原图硬链接（或复制）为输出。编码先在内存中完成，
+    结果不比原图小（且无需缩放）时同样保留原图
     
     Args:
         input_path: 输入图片路径
-        output_path: 输出图片路径
+        output_path: 输出图片路径，扩展名会替换为实际输出格式的扩展名
         quality: JPEG质量 (1-100)
+        max_size: 最大尺寸 (宽, 高)，超出时等比缩小，限制最长边时传入 (N, N)；None 表示不限制
+        max_pixels: 最大像素数，超出时等比缩小，None 表示不限制
+        source: 已预读的输入文件内容，None 表示从 input_path 读取
+        defer_write: 是否延后写入：编码数据记录在结果的 data 中，由调用方通过 write_deferred 写入
     
     Returns:
-        bool: 是否成功
+        CompressionResult: 压缩结果，失败时记录失败原因
     """
+    start = time.perf_counter()
+    result = CompressionResult(input_path, output_path, quality=quality)
     try:
-        img = Image.open(input_path)
-        
-        # 统一转 RGB，避免 PNG / RGBA 报错
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        
-        img.save(
-            output_path,
-            format="JPEG",
-            quality=quality,
-            optimize=True
-        )
-        return True
-    except Exception:
-        return False
+        f, result.input_size = _open_input(input_path, source)
+        with f:
+            with Image.open(f) as header:
+                source_quality = _can_pass_through(header, quality, max_size, max_pixels)
+                resized = _needs_resize(header, max_size, max_pixels)
+                source_format = header.format
+                source_width = header.width
+            if source_quality is not None:
+                result.output_path = _output_path_for(output_path, "JPEG")
+                _link_original(result, defer_write)
+                result.quality = source_quality
+                result.passthrough = True
+                result.elapsed = time.perf_counter() - start
+                return result
+
+            f.seek(0)
+            img = _open_rgb(f, max_size, max_pixels)
+
+        with stage("encode"):
+            data = _encode_jpeg(img, quality)
+            count_trial_encode()
+        result.trial_encodes = 1
+
+        if not resized and len(data) >= result.input_size:
+            _keep_original(result, source_format, defer_write)
+        else:
+            result.scale = img.width / source_width
+            result.output_path = _output_path_for(output_path, "JPEG")
+            _write_output(result, data, defer_write)
+    except Exception as e:
+        result.error = _describe_error(e)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _encode_jpeg(img, quality):
+    """
+    将图片编码为 JPEG 并返回字节数据（不写入磁盘）
 
+    Args:
+        img: 待编码的 RGB 图片
+        quality: JPEG质量 (1-100)
+
+    Returns:
+        bytes: 编码后的数据
+    """
+    buffer = io.BytesIO()
+    img.save(
+        buffer,
+        format="JPEG",
+        quality=quality,
+        optimize=True
+    )
+    return buffer.getvalue()
+
+
+def _analyze_image(img):
+    """
+    用最近邻缩略图（不引入新颜色）统计颜色数和相邻像素相同的比例
+
+    Args:
+        img: 已解码的图片（RGB、RGBA 或灰度）
+
+    Returns:
+        tuple: (colors, flat_ratio)，RGBA 图片的颜色包含透明度
+    """
+    size = _fit_size(img.size, (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    thumbnail = img.resize(size, Image.NEAREST)
+    if thumbnail.mode not in ("RGB", "RGBA"):
+        thumbnail = thumbnail.convert("RGB")
+    pixels = np.asarray(thumbnail, dtype=np.uint32)
+    packed = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+    if thumbnail.mode == "RGBA":
+        packed |= pixels[..., 3] << 24
+    colors = len(np.unique(packed))
+    if packed.shape[1] > 1:
+        flat_ratio = float(np.mean(packed[:, 1:] == packed[:, :-1]))
+    else:
+        flat_ratio = 0.0
+    return colors, flat_ratio
+
+
+def _encode(img, image_format, quality):
+    """
+    按指定格式编码为字节数据（不写入磁盘）
+
+    Args:
+        img: RGB 或灰度图片；WebP 和 PNG-8 也接受 RGBA（保留透明度），JPEG 不接受
+        image_format: "JPEG"、"WEBP"、"WEBP_LOSSLESS" 或 "PNG8"
+        quality: 有损格式的质量 (1-100)
 
-def compress_image_to_size(input_path, output_path, target_size):
+    Returns:
+        tuple: (Pillow 格式名, bytes)
+    """
+    if image_format == "JPEG":
+        return "JPEG", _encode_jpeg(img, quality)
+
+    buffer = io.BytesIO()
+    if image_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=quality, method=4)
+        return "WEBP", buffer.getvalue()
+    if image_format == "WEBP_LOSSLESS":
+        img.save(buffer, format="WEBP", lossless=True, quality=100, method=4)
+        return "WEBP", buffer.getvalue()
+
+    # 颜色不超过 256 种时量化是无损的；否则为有损的调色板近似
+    palette = img.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    palette.save(buffer, format="PNG", optimize=True)
+    return "PNG", buffer.getvalue()
+
+
+def choose_candidate_formats(img):
+    """
+    根据缩略图分析选出值得尝试的编码格式
+
+    颜色很少的图形用无损格式（PNG-8 / 无损 WebP）；颜色多但大面积纯色的
+    图片三种都尝试；照片类只比较 JPEG 和有损 WebP。
+    带透明像素的图片（RGBA）不尝试无法表示透明度的 JPEG
+
+    Args:
+        img: RGB、RGBA 或灰度图片
+
+    Returns:
+        tuple: 候选格式
+    """
+    colors, flat_ratio = _analyze_image(img)
+    if colors <= (GRAY_GRAPHIC_MAX_LEVELS if img.mode == "L" else GRAPHIC_MAX_COLORS):
+        return ("PNG8", "WEBP_LOSSLESS")
+    if img.mode == "RGBA":
+        return ("WEBP", "PNG8") if flat_ratio >= FLAT_RATIO else ("WEBP",)
+    if flat_ratio >= FLAT_RATIO:
+        return ("JPEG", "WEBP", "PNG8")
+    return ("JPEG", "WEBP")
+
+
+def compress_image_best_format(
+    input_path, output_path, quality, max_size=None, max_pixels=None, source=None, defer_write=False
+):
+    """
+    自动选择格式压缩图片：分析图片内容选出候选格式，在内存中逐一编码后取最小的结果
+
+    输出文件的扩展名与选中的格式一致；所有候选都不比原图小（且无需缩放）时保留原图
+
+    Args:
+        input_path: 输入图片路径
+        output_path: 输出图片路径，扩展名会替换为实际输出格式的扩展名
+        quality: 有损格式的质量 (1-100)
+        max_size: 最大尺寸 (宽, 高)，超出时等比缩小，限制最长边时传入 (N, N)；None 表示不限制
+        max_pixels: 最大像素数，超出时等比缩小，None 表示不限制
+        source: 已预读的输入文件内容，None 表示从 input_path 读取
+        defer_write: 是否延后写入：编码数据记录在结果的 data 中，由调用方通过 write_deferred 写入
+
+    Returns:
+        CompressionResult: 压缩结果，quality 仅在选中有损格式时有效
+    """
+    start = time.perf_counter()
+    result = CompressionResult(input_path, output_path)
+    try:
+        f, result.input_size = _open_input(input_path, source)
+        with f:
+            with Image.open(f) as header:
+                resized = _needs_resize(header, max_size, max_pixels)
+                source_format = header.format
+                source_width = header.width
+            f.seek(0)
+            img = _open_rgb(f, max_size, max_pixels, keep_alpha=True)
+
+        with stage("probe"):
+            candidates = choose_candidate_formats(img)
+
+        best_candidate = best_format = best_data = None
+        for candidate in candidates:
+            with stage("encode"):
+                image_format, data = _encode(img, candidate, quality)
+                count_trial_encode()
+            result.trial_encodes += 1
+            if best_data is None or len(data) < len(best_data):
+                best_format, best_data, best_candidate = image_format, data, candidate
+
+        if not resized and len(best_data) >= result.input_size:
+            _keep_original(result, source_format, defer_write)
+        else:
+            result.quality = quality if best_candidate in ("JPEG", "WEBP") else None
+            result.scale = img.width / source_width
+            result.output_path = _output_path_for(output_path, best_format)
+            _write_output(result, best_data, defer_write)
+    except Exception as e:
+        result.error = _describe_error(e)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _rendition_path(output_path, suffix, image_format):
+    """
+    生成某个输出规格的输出路径：在文件名后追加后缀，扩展名与输出格式一致
+
+    Args:
+        output_path: 输出路径（带原图扩展名）
+        suffix: 追加在文件名后的后缀，如 "_thumb"
+        image_format: 实际输出格式（Pillow 格式名）
+
+    Returns:
+        str: 输出路径
+    """
+    base, extension = os.path.splitext(output_path)
+    return _output_path_for(base + suffix + extension, image_format)
+
+
+def compress_image_renditions(input_path, output_path, renditions):
+    """
+    只解码一次，按多个规格（如原尺寸、网页版、缩略图）输出同一张图片
+
+    按最大的目标尺寸解码（JPEG 可直接以缩小的分辨率解码），各规格按尺寸
+    从大到小依次处理，较小的尺寸从上一个已生成的、仍不小于目标的尺寸缩小，
+    而不是每次都从原图缩小。与单张压缩不同，这里不会复用或保留原图，
+    每个规格都按指定的格式和质量编码
+
+    Args:
+        input_path: 输入图片路径
+        output_path: 输出图片路径，各规格在文件名后追加后缀，扩展名替换为输出格式的扩展名
+        renditions: [(max_size, quality, image_format, suffix), ...]，max_size 为最大尺寸
+            (宽, 高) 或 None（不缩小），image_format 为 "JPEG"、"WEBP"、"WEBP_LOSSLESS" 或 "PNG8"，
+            suffix 为追加在文件名后的后缀
+
+    Returns:
+        list: 与 renditions 一一对应的 CompressionResult；解码失败时全部记录失败原因，
+            某个规格编码或写入失败时只影响该规格
+    """
+    start = time.perf_counter()
+    results = [
+        CompressionResult(input_path, _rendition_path(output_path, suffix, image_format), quality=quality)
+        for max_size, quality, image_format, suffix in renditions
+    ]
+    try:
+        with open(input_path, "rb") as f:
+            input_size = os.fstat(f.fileno()).st_size
+            with Image.open(f) as header:
+                source_size = header.size
+            target_sizes = [_fit_size(source_size, max_size) for max_size, _, _, _ in renditions]
+            f.seek(0)
+            if target_sizes:
+                largest = max(range(len(renditions)), key=lambda index: target_sizes[index])
+                # 有 WebP / PNG-8 规格时保留透明度，只在编码 JPEG 规格时去掉
+                keep_alpha = any(image_format != "JPEG" for _, _, image_format, _ in renditions)
+                img = _open_rgb(f, renditions[largest][0], keep_alpha=keep_alpha)
+    except Exception as e:
+        error = _describe_error(e)
+        for result in results:
+            result.error = error
+            result.elapsed = time.perf_counter() - start
+        return results
+
+    # 从大到小处理，img 始终为已生成的最小尺寸
+    order = sorted(range(len(renditions)), key=lambda index: target_sizes[index], reverse=True)
+    for index in order:
+        _, quality, image_format, _ = renditions[index]
+        result = results[index]
+        result.input_size = input_size
+        result.scale = target_sizes[index][0] / source_size[0]
+        try:
+            if img.size != target_sizes[index]:
+                with stage("resize"):
+                    img = _resize(img, target_sizes[index])
+            encoded = img.convert("RGB") if image_format == "JPEG" and img.mode == "RGBA" else img
+            with stage("encode"):
+                actual_format, data = _encode(encoded, image_format, quality)
+                count_trial_encode()
+            result.trial_encodes = 1
+            if image_format not in ("JPEG", "WEBP"):
+                result.quality = None
+            result.output_path = _rendition_path(output_path, renditions[index][3], actual_format)
+            with stage("write"):
+                write_file_atomic(result.output_path, data)
+            result.output_size = len(data)
+        except Exception as e:
+            result.error = _describe_error(e)
+        result.elapsed = time.perf_counter() - start
+    return results
+
+
+def _make_probe(img):
+    """
+    从原图均匀截取若干原始分辨率的小块拼成缩略图
+
+    JPEG 的每像素字节数取决于原始分辨率下的局部细节，直接缩小会平滑掉噪点
+    和纹理而明显低估编码大小，因此采用拼贴的方式保留原始细节。
+    小块边长为 16 的倍数，与 JPEG 的编码块对齐，拼缝不会引入额外开销
+
+    Args:
+        img: RGB 原图
+
+    Returns:
+        Image: 缩略图
+    """
+    tile_width = min(PROBE_TILE, img.width)
+    tile_height = min(PROBE_TILE, img.height)
+    columns = max(1, min(PROBE_SIZE[0] // PROBE_TILE, img.width // tile_width))
+    rows = max(1, min(PROBE_SIZE[1] // PROBE_TILE, img.height // tile_height))
+
+    probe = Image.new("RGB", (columns * tile_width, rows * tile_height))
+    for row in range(rows):
+        top = (img.height - tile_height) * (2 * row + 1) // (2 * rows)
+        for column in range(columns):
+            left = (img.width - tile_width) * (2 * column + 1) // (2 * columns)
+            tile = img.crop((left, top, left + tile_width, top + tile_height))
+            probe.paste(tile, (column * tile_width, row * tile_height))
+    return probe
+
+
+def _fit_quality_model(img):
+    """
+    用缩略图试编码得到 log(每像素字节数) 随质量变化的曲线
+
+    Args:
+        img: RGB 原图
+
+    Returns:
+        list | None: [(quality, log_bpp), ...]，按质量升序且 log_bpp 单调不减；
+            图片不足缩略图的 4 倍大时试编码省不下时间，返回 None
+    """
+    if img.width * img.height <= 4 * PROBE_SIZE[0] * PROBE_SIZE[1]:
+        return None
+
+    probe = _make_probe(img)
+    probe_pixels = probe.width * probe.height
+
+    model = []
+    largest = -math.inf
+    for quality in PROBE_QUALITIES:
+        largest = max(largest, math.log(len(_encode_jpeg(probe, quality)) / probe_pixels))
+        count_probe_encode()
+        model.append((quality, largest))
+    return model
+
+
+def _model_log_bpp(model, quality):
+    """
+    在质量模型上线性插值得到 log(每像素字节数)
+
+    Args:
+        model: _fit_quality_model 返回的曲线
+        quality: 质量
+
+    Returns:
+        float: log(每像素字节数)
+    """
+    for (q0, y0), (q1, y1) in zip(model, model[1:]):
+        if quality <= q1 or q1 == model[-1][0]:
+            return y0 + (y1 - y0) * (quality - q0) / (q1 - q0)
+    return model[-1][1]
+
+
+def _predict_quality(model, target_log):
+    """
+    在质量模型上反查满足目标 log(每像素字节数) 的质量
+
+    Args:
+        model: _fit_quality_model 返回的曲线
+        target_log: 目标 log(每像素字节数)
+
+    Returns:
+        int: 预测的质量（超出曲线范围时外推，由调用方限制到有效范围）
+    """
+    for (q0, y0), (q1, y1) in zip(model, model[1:]):
+        if target_log <= y1 or q1 == model[-1][0]:
+            if y1 == y0:
+                return q1 if target_log >= y1 else q0
+            return int(q0 + (q1 - q0) * (target_log - y0) / (y1 - y0))
+    return model[-1][0]
+
+
+class _QualitySearch:
+    """
+    质量搜索的状态：[low, high] 为尚未确定的区间，每次试编码都会收窄区间，
+    并记录满足目标的最高质量及其编码数据
+    """
+
+    def __init__(self, img, target_size, min_quality, max_quality):
+        self.img = img
+        self.target_size = target_size
+        self.low, self.high = min_quality, max_quality
+        self.best_quality = None
+        self.best_data = None
+        self.fallback_data = None
+        self.trials = 0
+
+    @property
+    def open(self):
+        """区间中是否还有未确定的质量"""
+        return self.low <= self.high
+
+    def clamp(self, quality):
+        return min(max(quality, self.low), self.high)
+
+    def probe(self, quality):
+        """
+        按指定质量编码一次并收窄区间
+
+        Returns:
+            int: 编码大小（字节）
+        """
+        with stage("encode"):
+            data = _encode_jpeg(self.img, quality)
+            count_trial_encode()
+        self.trials += 1
+
+        if len(data) <= self.target_size:
+            self.best_quality = quality
+            self.best_data = data
+            self.low = quality + 1
+        else:
+            self.fallback_data = data
+            self.high = quality - 1
+        return len(data)
+
+    def from_hint(self, start_quality):
+        """
+        从跨图片预测的质量出发试编码
+
+        Returns:
+            tuple: (quality, size, near)，最后一次编码的质量和大小，以及预测是否接近目标
+        """
+        quality = self.clamp(round(start_quality))
+        size = self.probe(quality)
+        near = abs(math.log(size / self.target_size)) <= HINT_NEIGHBOR_RANGE
+        if near:
+            # 预测准确时与相邻质量正好跨过目标边界
+            neighbor = quality + 1 if size <= self.target_size else quality - 1
+            if self.low <= neighbor <= self.high:
+                quality, size = neighbor, self.probe(neighbor)
+        return quality, size, near
+
+    def gallop(self, quality, size):
+        """从已编码的质量出发，沿同一方向以 2、4、8…的步长试探，直到越过边界"""
+        step = 2
+        while self.open:
+            fits = size <= self.target_size
+            quality = self.clamp(quality + step if fits else quality - step)
+            size = self.probe(quality)
+            if (size <= self.target_size) != fits:
+                break
+            step *= 2
+
+    def from_model(self, model, quality=None, size=None):
+        """
+        按质量模型预测（没有已编码的结果时先按模型编码一次），用实际大小校正曲线偏移后
+        再次预测，并检查校正后的质量及其相邻质量
+        """
+        pixels = self.img.width * self.img.height
+        target_log = math.log(self.target_size / pixels)
+
+        if size is None:
+            quality = self.clamp(_predict_quality(model, target_log))
+            size = self.probe(quality)
+
+        # 用全尺寸的实际大小校正整条曲线的偏移后再次预测
+        offset = math.log(size / pixels) - _model_log_bpp(model, quality)
+        quality = _predict_quality(model, target_log - offset)
+
+        # 已探测过的质量会被 low/high 排除，限制范围后自然落到相邻质量上
+        for _ in range(2):
+            if not self.open:
+                break
+            quality = self.clamp(quality)
+            quality += 1 if self.probe(quality) <= self.target_size else -1
+
+    def bisect(self):
+        """二分查找剩余的区间"""
+        while self.open:
+            self.probe((self.low + self.high) // 2)
+
+
+def _search_quality(img, target_size, min_quality, max_quality, model=None, start_quality=None):
+    """
+    查找满足目标大小的最高质量，试编码均在内存中完成
+
+    给出起始质量（跨图片预测）时先编码该质量，大小接近目标时再编码相邻质量，
+    预测准确时两次编码即可确定；否则才拟合质量模型，从已收窄的区间继续
+    （图片太小没有模型时以倍增的步长向边界试探）。给出质量模型时，先按模型预测的质量
+    编码一次，用实际大小校正模型后再次预测，并检查校正后的质量及其相邻质量；
+    预测准确时只需两到三次编码。剩余的不确定区间（以及没有模型时的整个区间）
+    使用二分查找，每次编码都会收窄区间，结果总是满足目标大小的最高质量
+
+    Args:
+        img: 待编码的 RGB 图片
+        target_size: 目标大小（字节）
+        min_quality: 最低质量
+        max_quality: 最高质量
+        model: _fit_quality_model 返回的曲线，None 表示直接二分
+        start_quality: 预测的质量（未限制范围），给出时作为第一次编码的质量，
+            不再按 model 预测第一次编码的质量
+
+    Returns:
+        tuple: (quality, data, trials, probes)，满足目标大小的最高质量、其编码数据、编码次数
+            及搜索中拟合质量模型的缩略图试编码次数；最低质量仍超出时 quality 为 None，
+            data 为最低质量的编码数据
+    """
+    search = _QualitySearch(img, target_size, min_quality, max_quality)
+    quality = size = None
+    probes = 0
+    if start_quality is not None and target_size > 0:
+        quality, size, near = search.from_hint(start_quality)
+        if search.open and model is None:
+            with stage("probe"):
+                model = _fit_quality_model(img)
+            probes = len(model) if model is not None else 0
+        if model is None and near:
+            # 没有模型（小图）时从接近目标的预测出发逐步扩大步长
+            search.gallop(quality, size)
+        elif not near:
+            # 与目标相差较远时只用于收窄区间，由质量模型重新预测
+            size = None
+
+    if model is not None and target_size > 0 and search.open:
+        search.from_model(model, quality, size)
+    search.bisect()
+
+    if search.best_quality is None:
+        return None, search.fallback_data, search.trials, probes
+    return search.best_quality, search.best_data, search.trials, probes
+
+
+def _image_features(img, target_size, source_bpp):
+    """
+    计算跨图片质量预测使用的特征
+
+    Args:
+        img: 待编码的 RGB 图片
+        target_size: 目标大小（字节）
+        source_bpp: 原图文件的每像素字节数
+
+    Returns:
+        tuple: (target_bpp, source_bpp, variance)，目标每像素字节数、原图每像素字节数
+            和缩略图灰度方差
+    """
+    size = _fit_size(img.size, (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    thumbnail = img.resize(size, Image.BILINEAR, reducing_gap=REDUCING_GAP).convert("L")
+    variance = float(np.var(np.asarray(thumbnail, dtype=np.float32)))
+    return target_size / (img.width * img.height), source_bpp, variance
+
+
+def compress_image_to_size(
+    input_path, output_path, target_size, max_size=None, max_pixels=None, predictor=None,
+    source=None, defer_write=False,
+):
     """
     压缩单张图片到目标大小
-    
+
+    先用缩略图试编码拟合质量模型，预测满足目标大小的质量，
+    再在每个缩放比例下从预测值出发查找满足目标大小的最高质量，
+    最低质量仍超出目标时才缩小尺寸。试编码只在内存中进行，
+    最终结果只写入磁盘一次。原图本身不超过目标大小（且无需缩放）时
+    直接保留原图，不再解码；编码结果不比原图小时同样保留原图
+
     Args:
         input_path: 输入图片路径
-        output_path: 输出图片路径
+        output_path: 输出图片路径，扩展名会替换为实际输出格式的扩展名
         target_size: 目标大小（字节）
+        max_size: 最大尺寸 (宽, 高)，超出时等比缩小，限制最长边时传入 (N, N)；None 表示不限制
+        max_pixels: 最大像素数，超出时等比缩小，None 表示不限制
+        predictor: QualityPredictor.snapshot() 的回归系数，给出时计算质量预测特征
+            （记录在结果的 features 中），原尺寸下从预测的质量开始搜索，
+            不再拟合质量模型；None 表示不使用跨图片预测
+        source: 已预读的输入文件内容，None 表示从 input_path 读取
+        defer_write: 是否延后写入：编码数据记录在结果的 data 中，由调用方通过 write_deferred 写入
     
     Returns:
-        bool: 是否成功
+        CompressionResult: 压缩结果，失败时记录失败原因
     """
+    start = time.perf_counter()
+    result = CompressionResult(input_path, output_path)
     try:
-        img = Image.open(input_path)
-        original_size = img.size
-
-        # 统一转 RGB，避免 PNG / RGBA 报错
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-
-        # 质量压缩（从较低质量开始，更激进）
-        quality = 60
-        min_quality = 15
-        scale = 1.0
-        
-        while True:
-            # 如果已经缩小过，需要重新打开原图
+        # 只解码一次，各缩放比例均从内存中的原图生成
+        f, result.input_size = _open_input(input_path, source)
+        with f:
+            with Image.open(f) as header:
+                resized = _needs_resize(header, max_size, max_pixels)
+                source_format = header.format
+                source_width = header.width
+                source_pixels = header.width * header.height
+            if not resized and result.input_size <= target_size:
+                _keep_original(result, source_format, defer_write)
+                result.elapsed = time.perf_counter() - start
+                return result
+
+            f.seek(0)
+            source = _open_rgb(f, max_size, max_pixels)
+
+        hint = None
+        if predictor is not None and target_size > 0:
+            with stage("probe"):
+                features = _image_features(source, target_size, result.input_size / source_pixels)
+            result.features = (source_format, features)
+            hint = predict_quality(predictor, source_format, features)
+
+        model = None
+        for scale in (1.0, 0.9, 0.8, 0.7, 0.6, 0.5):
             if scale < 1.0:
-                img = Image.open(input_path)
-                if img.mode in ("RGBA", "P"):
-                    img = img.convert("RGB")
-                new_size = (int(original_size[0] * scale), int(original_size[1] * scale))
-                img = img.resize(new_size, Image.LANCZOS)
+                new_size = (int(source.width * scale), int(source.height * scale))
+                with stage("resize"):
+                    img = source.resize(new_size, Image.LANCZOS)
+            else:
+                img = source
             
-            # 尝试保存
-            img.save(
-                output_path,
-                format="JPEG",
-                quality=quality,
-                optimize=True
+            if model is None and hint is None:
+                # 预测只用于原尺寸，需要缩小尺寸时再拟合质量模型
+                with stage("probe"):
+                    model = _fit_quality_model(source)
+                result.probe_encodes += len(model) if model is not None else 0
+            quality, data, trials, probes = _search_quality(
+                img, target_size, MIN_QUALITY, MAX_QUALITY, model, start_quality=hint
             )
-            
-            current_size = os.path.getsize(output_path)
-            
-            if current_size <= target_size:
+            result.trial_encodes += trials
+            result.probe_encodes += probes
+            hint = None
+            if quality is not None:
                 break
-            
-            # 如果质量还可以继续降低
-            if quality > min_quality:
-                quality -= 5
-            # 如果质量已经最低，开始缩小尺寸
-            elif scale > 0.5:
-                scale -= 0.1
-                quality = 60  # 重置质量，从头开始
-            else:
-                # 已经压缩到极限
-                break
-        return True
-    except Exception:
-        return False
+            # 最小比例仍无法满足时，保留最低质量的结果（已经压缩到极限）
+        if scale < 1.0:
+            # 缩小尺寸后的质量不反映特征与目标的关系，不用于跨图片预测
+            result.features = None
+
+        result.quality = quality if quality is not None else MIN_QUALITY
+        if not resized and len(data) >= result.input_size:
+            _keep_original(result, source_format, defer_write)
+        else:
+            result.scale = img.width / source_width
+            result.output_path = _output_path_for(output_path, "JPEG")
+            _write_output(result, data, defer_write)
+    except Exception as e:
+        result.error = _describe_error(e)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def estimate_jpeg_sizes(
+    input_path, qualities, max_size=None, max_pixels=None, probe_size=(256, 256), source=None
+):
+    """
+    通过缩略图试编码估算全尺寸 JPEG 在各质量下的大小
 
+    缩略图按每像素字节数外推到原图像素数。缩略图细节更密集，
+    估算值通常偏大，但不同图片之间的相对大小足以用于预算分配
+
+    Args:
+        input_path: 输入图片路径
+        qualities: 要估算的质量列表
+        max_size: 压缩时的最大尺寸 (宽, 高)，None 表示不限制
+        max_pixels: 压缩时的最大像素数，None 表示不限制
+        probe_size: 缩略图最大尺寸 (宽, 高)
+        source: 已读入的输入文件内容，None 表示从 input_path 读取
+
+    Returns:
+        list: [(quality, estimated_size), ...]，按质量升序
+    """
+    f, _ = _open_input(input_path, source)
+    with f:
+        with Image.open(f) as img:
+            width, height = _fit_size(img.size, max_size, max_pixels)
+            pixels = width * height
+        f.seek(0)
+        probe = _open_rgb(f, probe_size)
+    probe_pixels = probe.width * probe.height
+
+    estimates = []
+    for quality in sorted(qualities):
+        bytes_per_pixel = len(_encode_jpeg(probe, quality)) / probe_pixels
+        estimates.append((quality, int(bytes_per_pixel * pixels)))
+    return estimates
+
+
+def estimate_peak_memory(input_path):
+    """
+    根据文件头估算压缩单张图片时的内存峰值（不解码像素）
+
+    按原始模式解码的图片、转换后的 RGB 副本以及缩小尺寸时的
+    一份 RGB 副本同时驻留来保守估计（Pillow 中多通道图片每像素占 4 字节）
+
+    Args:
+        input_path: 输入图片路径或已读入内容的文件对象
+
+    Returns:
+        int: 估算的峰值内存（字节），无法读取文件头时为 0
+    """
+    try:
+        with Image.open(input_path) as img:
+            width, height = img.size
+            source_bytes = 1 if img.mode in ("1", "L", "P") else 4
+    except Exception:
+        return 0
+    return width * height * (source_bytes + 4 * 2)
@@ -0,0 +1,165 @@
+"""
+重复输入合并模块
+按 (文件大小, 内容哈希) 将内容相同的输入分组，每组只压缩一张，
+其余图片的输出硬链接（或复制）自该图片的输出
+"""
+import os
+
+from cache import hash_file
+from compressors import CompressionResult
+from file_utils import link_or_copy_atomic
+
+
+class _Group:
+    """一组内容相同的输入：代表图片及等待其结果的重复图片"""
+
+    def __init__(self, input_path):
+        self.input_path = input_path
+        self.content_hash = None
+        self.done = False
+        self.result = None
+        self.error = None
+        self.waiting = []
+
+
+class Deduplicator:
+    """重复输入索引，只对大小相同的文件计算内容哈希"""
+
+    def __init__(self, stats=None):
+        """
+        Args:
+            stats: 扫描时记录的 {path: (size, mtime_ns)}，分组时不再 stat 输入文件
+        """
+        self.stats = stats if stats is not None else {}
+        self.inputs = 0
+        self.duplicates = 0
+        # {(size, params): [_Group, ...]}
+        self._groups = {}
+        # {代表任务: _Group}
+        self._representatives = {}
+
+    def _input_size(self, input_path):
+        stat = self.stats.get(input_path)
+        return stat[0] if stat is not None else os.path.getsize(input_path)
+
+    def claim(self, job, content_hash=None):
+        """
+        登记一个任务，判断是否与已登记的任务内容相同
+
+        Args:
+            job: (input_path, output_path, *params)
+            content_hash: 已从读入的内容计算出的哈希，给出时不再读取输入文件
+
+        Returns:
+            list | None: None 表示该任务是新的代表，需要实际压缩；否则为重复图片，
+                返回现在即可完成的 [(job, CompressionResult)]（代表尚未完成时为空列表，
+                结果由 complete 返回）
+        """
+        self.inputs += 1
+        input_path = job[0]
+        try:
+            key = (self._input_size(input_path), tuple(job[2:]))
+            groups = self._groups.setdefault(key, [])
+            if content_hash is None and groups:
+                content_hash = hash_file(input_path)
+            for group in groups:
+                if group.content_hash is None:
+                    group.content_hash = hash_file(group.input_path)
+                if group.content_hash == content_hash:
+                    break
+            else:
+                group = _Group(input_path)
+                group.content_hash = content_hash
+                groups.append(group)
+                self._representatives[job] = group
+                return None
+        except OSError:
+            # 无法读取时交给压缩函数处理并报告错误
+            return None
+
+        self.duplicates += 1
+        if not group.done:
+            group.waiting.append(job)
+            return []
+        return [(job, self._resolve(job, group))]
+
+    def count_skipped(self):
+        """登记一个无需执行的任务（命中进度日志或结果缓存），只计入输入数"""
+        self.inputs += 1
+
+    def complete(self, job, result, error=None):
+        """
+        记录代表任务的结果，完成等待该结果的重复图片
+
+        Args:
+            job: 代表任务
+            result: 代表任务的 CompressionResult，任务抛出异常时为 None
+            error: 任务抛出的异常
+
+        Returns:
+            list: [(job, CompressionResult)]，不是代表任务时为空列表
+        """
+        group = self._representatives.pop(job, None)
+        if group is None:
+            return []
+        group.done = True
+        group.result = result
+        group.error = error
+        waiting, group.waiting = group.waiting, []
+        return [(duplicate, self._resolve(duplicate, group)) for duplicate in waiting]
+
+    def reuse(self, job, source_output_path, output_size):
+        """
+        代表任务复用以前运行中内容相同的其他输入的输出（由结果缓存找到），计为重复图片
+
+        Args:
+            job: claim 返回 None 的代表任务
+            source_output_path: 已有的输出路径
+            output_size: 已有输出的大小（字节）
+
+        Returns:
+            CompressionResult | None: 硬链接（或复制）成功时的结果，失败时为 None（任务照常压缩）
+        """
+        input_path = job[0]
+        output_path = os.path.splitext(job[1])[0] + os.path.splitext(source_output_path)[1]
+        try:
+            link_or_copy_atomic(source_output_path, output_path)
+            input_size = self._input_size(input_path)
+        except OSError:
+            return None
+        self.duplicates += 1
+        return CompressionResult(
+            input_path, output_path, input_size=input_size, output_size=output_size, deduplicated=True
+        )
+
+    def _resolve(self, job, group):
+        """将代表的输出硬链接（或复制）为重复图片的输出，扩展名沿用代表的输出"""
+        input_path, output_path = job[0], job[1]
+        source = group.result
+        if not source:
+            error = source.error if source is not None else f"{type(group.error).__name__}: {group.error}"
+            return CompressionResult(input_path, output_path, error=f"与 {group.input_path} 内容相同，{error}")
+
+        output_path = os.path.splitext(output_path)[0] + os.path.splitext(source.output_path)[1]
+        try:
+            link_or_copy_atomic(source.output_path, output_path)
+        except OSError as e:
+            return CompressionResult(input_path, output_path, error=f"{type(e).__name__}: {e}")
+        return CompressionResult(
+            input_path,
+            output_path,
+            input_size=source.input_size,
+            output_size=source.output_size,
+            quality=source.quality,
+            scale=source.scale,
+            deduplicated=True,
+        )
+
+    def ratio(self):
+        """
+        获取去重率
+
+        Returns:
+            float: 重复图片占全部输入的比例 (0-1)，没有输入时为 0
+        """
+        return self.duplicates / self.inputs if self.inputs else 0.0
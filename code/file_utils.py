@@ -2,42 +2,230 @@
 文件处理工具模块
 """
 import os
+import queue
+import shutil
+import threading
 
 
-def get_image_files(path):
+SUPPORTED_FORMATS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def _same_file(entry, identity):
+    """
+    判断目录项是否为 (st_dev, st_ino) 标识的目录
+    
+    先比较 DirEntry 自带的 inode（POSIX 上无需额外系统调用），
+    只有 inode 相同时才读取 stat 比较设备号
+    """
+    try:
+        if entry.inode() != identity[1]:
+            return False
+        return entry.stat(follow_symlinks=False).st_dev == identity[0]
+    except OSError:
+        return False
+
+
+def scan_image_entries(path, exclude_dir=None):
+    """
+    基于 os.scandir 遍历图片文件，同时返回扫描时得到的文件信息
+    
+    输出目录按设备号和 inode 精确排除，不依赖路径字符串匹配
+    
+    Args:
+        path: 文件或文件夹路径
+        exclude_dir: 需要排除的目录（通常为输出目录），None 表示不排除
+    
+    Yields:
+        tuple: (root, filename, stat)，stat 为扫描时得到的 os.stat_result
+    """
+    if os.path.isfile(path):
+        # 单张图片
+        if path.lower().endswith(SUPPORTED_FORMATS):
+            yield os.path.dirname(path), os.path.basename(path), os.stat(path)
+        return
+    if not os.path.isdir(path):
+        return
+    
+    exclude_identity = None
+    if exclude_dir is not None:
+        try:
+            exclude_stat = os.stat(exclude_dir)
+            exclude_identity = (exclude_stat.st_dev, exclude_stat.st_ino)
+        except OSError:
+            pass
+    
+    # 文件夹（与 os.walk 一样不跟随目录符号链接，无法读取的目录直接跳过）
+    pending_dirs = [path]
+    while pending_dirs:
+        root = pending_dirs.pop()
+        subdirs = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if exclude_identity is None or not _same_file(entry, exclude_identity):
+                                subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(SUPPORTED_FORMATS) and entry.is_file():
+                            yield root, entry.name, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        pending_dirs.extend(reversed(subdirs))
+
+
+def iter_image_files(path, exclude_dir=None):
+    """
+    逐个生成图片文件，边遍历边返回
+    
+    Args:
+        path: 文件或文件夹路径
+        exclude_dir: 需要排除的目录（通常为输出目录），None 表示不排除
+    
+    Yields:
+        tuple: (root, filename)
+    """
+    for root, file, _ in scan_image_entries(path, exclude_dir):
+        yield root, file
+
+
+def get_image_files(path, exclude_dir=None):
     """
     获取图片文件列表
     
     Args:
         path: 文件或文件夹路径
+        exclude_dir: 需要排除的目录（通常为输出目录），None 表示不排除
     
     Returns:
         list: [(root, filename), ...] 格式的图片文件列表
     """
-    image_files = []
-    supported_formats = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+    return list(iter_image_files(path, exclude_dir))
+
+
+class ImageScanner:
+    """
+    后台图片扫描器
     
-    if os.path.isfile(path):
-        # 单张图片
-        if path.lower().endswith(supported_formats):
-            image_files.append((os.path.dirname(path), os.path.basename(path)))
-    elif os.path.isdir(path):
-        # 文件夹
-        for root, _, files in os.walk(path):
-            for file in files:
-                if file.lower().endswith(supported_formats):
-                    file_path = os.path.join(root, file)
-                    # 跳过输出目录
-                    if "compressed" in file_path:
-                        try:
-                            common_path = os.path.commonpath([path, file_path])
-                            if common_path == path:
-                                continue
-                        except ValueError:
-                            pass
-                    image_files.append((root, file))
-    
-    return image_files
+    在后台线程中遍历目录，通过有界队列把图片文件逐个交给压缩流程，
+    第一张图片扫描到即可开始压缩。扫描未结束时 count 为已扫描数量，
+    结束后为真实总数。扫描时得到的文件大小和修改时间保存在 stats 中，
+    后续流程无需再次 stat。只能迭代一次
+    """
+    
+    _DONE = object()
+    
+    def __init__(self, path, exclude_dir=None, maxsize=1024):
+        self.path = path
+        self.exclude_dir = exclude_dir
+        self.count = 0
+        self.stats = {}
+        self.finished = False
+        self._error = None
+        self._queue = queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._scan, daemon=True)
+        self._thread.start()
+    
+    def _put(self, item):
+        """放入队列，队列已满时等待，扫描器被关闭则放弃"""
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _scan(self):
+        """扫描线程"""
+        try:
+            for root, file, stat in scan_image_entries(self.path, self.exclude_dir):
+                self.stats[os.path.join(root, file)] = (stat.st_size, stat.st_mtime_ns)
+                self.count += 1
+                if not self._put((root, file)):
+                    return
+        except Exception as e:
+            self._error = e
+        self.finished = True
+        self._put(self._DONE)
+    
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                break
+            yield item
+        if self._error is not None:
+            raise self._error
+    
+    def close(self):
+        """停止扫描（提前结束压缩时调用）"""
+        self._stopped.set()
+    
+    def total_label(self):
+        """
+        获取用于进度显示的总数
+        
+        Returns:
+            str: 扫描结束后为总数，否则为 "已扫描数量+"
+        """
+        return str(self.count) if self.finished else f"{self.count}+"
+
+
+def _stem_groups(root):
+    """
+    按文件名主体（不区分大小写的平台上忽略大小写）将目录中的图片分组
+
+    Returns:
+        dict: {stem: [filename, ...]}，每组按 JPEG 优先、再按文件名排序
+    """
+    groups = {}
+    try:
+        names = os.listdir(root)
+    except OSError:
+        names = []
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        if extension.lower() in SUPPORTED_FORMATS:
+            groups.setdefault(os.path.normcase(stem), []).append(name)
+    for group in groups.values():
+        group.sort(key=lambda name: (os.path.splitext(name)[1].lower() not in (".jpg", ".jpeg"), name))
+    return groups
+
+
+def iter_file_pairs(image_files, input_base_path, output_dir):
+    """
+    为图片文件逐个生成输入、输出路径
+    
+    Args:
+        image_files: [(root, filename), ...] 或 ImageScanner
+        input_base_path: 输入的基准路径（文件夹或单文件）
+        output_dir: 输出目录
+    
+    Yields:
+        tuple: (input_path, output_path)
+    """
+    # 压缩器会把扩展名替换为实际输出格式的扩展名，同一目录下 a.png 与 a.jpg
+    # 会争用同一个输出文件名。按目录内容而不是扫描顺序决定：同名的图片中
+    # JPEG 优先（其次按文件名）保留原文件名主体，其余改用 a_png 这样的主体，
+    # 每次运行的输出路径都相同
+    single_file = os.path.isfile(input_base_path)
+    # 扫描器逐个目录返回图片，只需保留当前目录的分组
+    groups_root = groups = None
+    for root, file in image_files:
+        input_path = os.path.join(root, file)
+        output_path = get_output_path(input_path, input_base_path, output_dir)
+        if not single_file:
+            if root != groups_root:
+                groups_root, groups = root, _stem_groups(root)
+            stem, extension = os.path.splitext(file)
+            group = groups.get(os.path.normcase(stem), [file])
+            if group[0] != file:
+                output_stem, output_extension = os.path.splitext(output_path)
+                output_path = f"{output_stem}_{extension.lstrip('.').lower()}{output_extension}"
+        yield input_path, output_path
 
 
 def get_output_path(input_path, input_base_path, output_dir):
@@ -71,6 +259,79 @@ def get_output_path(input_path, input_base_path, output_dir):
         return output_path
 
 
+def _temp_path(path):
+    """生成与目标文件同目录的临时文件名（同一文件系统内 rename 才是原子的）"""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.{os.getpid()}.tmp")
+
+
+def write_file_atomic(path, data):
+    """
+    原子写入文件：先写入临时文件再重命名，中途中断不会留下写了一半的输出
+    
+    Args:
+        path: 目标文件路径
+        data: 要写入的字节数据
+    """
+    temp_path = _temp_path(path)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def copy_file_atomic(src, dst):
+    """
+    原子复制文件：先复制到临时文件再重命名
+    
+    Args:
+        src: 源文件路径
+        dst: 目标文件路径
+    """
+    temp_path = _temp_path(dst)
+    try:
+        shutil.copyfile(src, temp_path)
+        os.replace(temp_path, dst)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def link_or_copy_atomic(src, dst):
+    """
+    原子地将文件硬链接到目标路径，跨文件系统等无法硬链接时改为复制
+    
+    Args:
+        src: 源文件路径
+        dst: 目标文件路径
+    """
+    # 目标已是源文件的硬链接时无需处理；同一 inode 的两个链接之间 rename 什么也不做，
+    # 临时链接会被留下
+    try:
+        if os.path.samefile(src, dst):
+            return
+    except OSError:
+        pass
+
+    temp_path = _temp_path(dst)
+    try:
+        os.link(src, temp_path)
+    except OSError:
+        copy_file_atomic(src, dst)
+        return
+    try:
+        os.replace(temp_path, dst)
+    finally:
+        # 并发写入使目标在检查后变成同一文件时，rename 同样不会移除临时链接
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+
+
 def format_size(size_bytes):
     """
     格式化文件大小
@@ -21,8 +21,9 @@ if sys.platform == "win32":
         except:
             pass
 
-from compressors import compress_image_fixed_quality, compress_image_to_size
-from file_utils import get_image_files, get_output_path, format_size
+from batch import compress_batch_fixed_quality, compress_batch_to_size, get_default_workers, plan_batch_to_size
+from cache import ResultCache
+from file_utils import ImageScanner, format_size, iter_file_pairs
 
 
 class FluentStyle:
@@ -67,6 +68,9 @@ class ImageCompressorGUI:
         self.compression_mode = tk.StringVar(value="quality")
         self.quality_value = tk.IntVar(value=85)
         self.target_size_mb = tk.DoubleVar(value=20.0)
+        self.workers_value = tk.IntVar(value=get_default_workers())
+        self.max_edge_value = tk.IntVar(value=0)
+        self.max_megapixels_value = tk.DoubleVar(value=0.0)
         self.is_processing = False
         
         # 创建界面
@@ -272,6 +276,60 @@ class ImageCompressorGUI:
         size_spinbox.pack(side=tk.LEFT, padx=(0, 8))
         ttk.Label(size_frame, text="MB", font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)).pack(side=tk.LEFT)
         
+        # 并行进程数
+        workers_frame = ttk.Frame(mode_frame)
+        workers_frame.grid(row=4, column=0, sticky=tk.W, pady=(16, 0))
+        
+        ttk.Label(workers_frame, text="并行进程数:", font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)).pack(
+            side=tk.LEFT, padx=(0, 8)
+        )
+        workers_spinbox = ttk.Spinbox(
+            workers_frame,
+            from_=1,
+            to=256,
+            textvariable=self.workers_value,
+            width=8,
+            font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)
+        )
+        workers_spinbox.pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Label(
+            workers_frame, text=f"(默认为CPU核心数 {get_default_workers()})", style="Secondary.TLabel"
+        ).pack(side=tk.LEFT)
+        
+        # 尺寸限制
+        resize_frame = ttk.Frame(mode_frame)
+        resize_frame.grid(row=5, column=0, sticky=tk.W, pady=(16, 0))
+        
+        ttk.Label(resize_frame, text="最长边上限:", font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)).pack(
+            side=tk.LEFT, padx=(0, 8)
+        )
+        max_edge_spinbox = ttk.Spinbox(
+            resize_frame,
+            from_=0,
+            to=65535,
+            increment=100,
+            textvariable=self.max_edge_value,
+            width=8,
+            font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)
+        )
+        max_edge_spinbox.pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Label(resize_frame, text="像素", style="Secondary.TLabel").pack(side=tk.LEFT, padx=(0, 16))
+        
+        ttk.Label(resize_frame, text="像素数上限:", font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)).pack(
+            side=tk.LEFT, padx=(0, 8)
+        )
+        max_megapixels_spinbox = ttk.Spinbox(
+            resize_frame,
+            from_=0,
+            to=1000,
+            increment=1,
+            textvariable=self.max_megapixels_value,
+            width=8,
+            font=(fs.FONT_FAMILY, fs.FONT_SIZE_MEDIUM)
+        )
+        max_megapixels_spinbox.pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Label(resize_frame, text="百万像素 (0 为不限制)", style="Secondary.TLabel").pack(side=tk.LEFT)
+        
         # 开始按钮
         row += 2
         self.start_button = ttk.Button(
@@ -382,82 +440,94 @@ class ImageCompressorGUI:
         self.is_processing = True
         self.start_button.config(state="disabled")
         self.log_text.delete(1.0, tk.END)
+        scanner = None
+        cache = None
         
         try:
             input_path = self.input_path.get().strip()
             output_dir = self.output_path.get().strip()
             os.makedirs(output_dir, exist_ok=True)
             
-            self.log("正在扫描图片文件...")
-            image_files = get_image_files(input_path)
-            
-            if not image_files:
-                self.log("❌ 未找到任何图片文件！")
-                messagebox.showwarning("警告", "未找到任何图片文件！")
-                return
-            
-            total_files = len(image_files)
-            self.log(f"找到 {total_files} 张图片\n")
-            
             total_size = 0
             success_count = 0
             fail_count = 0
             mode = self.compression_mode.get()
             
+            # 后台线程扫描图片文件，固定质量模式边扫描边压缩
+            scanner = ImageScanner(input_path, output_dir)
+            if mode == "size":
+                # 目标大小模式需要先知道全部图片才能分配预算
+                self.log("正在扫描图片文件...")
+                image_files = list(scanner)
+                
+                if not image_files:
+                    self.log("❌ 未找到任何图片文件！")
+                    messagebox.showwarning("警告", "未找到任何图片文件！")
+                    return
+                
+                self.log(f"找到 {len(image_files)} 张图片\n")
+            else:
+                image_files = scanner
+            
+            workers = max(1, self.workers_value.get())
+            max_edge = self.max_edge_value.get()
+            max_size = (max_edge, max_edge) if max_edge > 0 else None
+            max_megapixels = self.max_megapixels_value.get()
+            max_pixels = int(max_megapixels * 1_000_000) if max_megapixels > 0 else None
+            cache = ResultCache(output_dir, scanner.stats)
+            file_pairs = iter_file_pairs(image_files, input_path, output_dir)
+            
             if mode == "quality":
                 quality = self.quality_value.get()
-                self.log(f"开始压缩（质量: {quality}）...\n")
-                
-                for idx, (root, file) in enumerate(image_files, 1):
-                    input_file_path = os.path.join(root, file)
-                    output_file_path = get_output_path(input_file_path, input_path, output_dir)
-                    
-                    try:
-                        if compress_image_fixed_quality(input_file_path, output_file_path, quality):
-                            size = os.path.getsize(output_file_path)
-                            total_size += size
-                            success_count += 1
-                            self.log(f"✔ [{idx}/{total_files}] {file} → {format_size(size)}")
-                        else:
-                            fail_count += 1
-                            self.log(f"✖ [{idx}/{total_files}] {file} 压缩失败")
-                    except Exception as e:
-                        fail_count += 1
-                        self.log(f"✖ [{idx}/{total_files}] {file} 压缩失败: {str(e)}")
-                    
-                    progress = (idx / total_files) * 100
-                    self.progress_var.set(progress)
-                    self.progress_label.config(text=f"处理中: {idx}/{total_files}")
-                    self.root.update_idletasks()
+                self.log(f"开始压缩（质量: {quality}，进程数: {workers}）...\n")
+                results = compress_batch_fixed_quality(
+                    file_pairs, quality, workers, cache, scanner.stats, max_size=max_size, max_pixels=max_pixels
+                )
             
             else:  # size mode
                 total_max_size = int(self.target_size_mb.get() * 1024 * 1024)
-                target_size_per_image = total_max_size // total_files
                 
                 self.log(f"目标总大小: {format_size(total_max_size)}")
-                self.log(f"平均每张目标大小: {format_size(target_size_per_image)}\n")
+                self.log("正在分析图片，分配每张图片的目标大小...")
+                input_paths = [os.path.join(root, file) for root, file in image_files]
+                target_sizes, planned_quality = plan_batch_to_size(
+                    input_paths, total_max_size, workers, scanner.stats, max_size, max_pixels, cache
+                )
+                if planned_quality is not None:
+                    self.log(f"预估统一质量: {planned_quality}\n")
+                else:
+                    self.log("⚠ 预算不足，部分图片将缩小尺寸\n")
+                results = compress_batch_to_size(
+                    file_pairs, target_sizes, workers, cache, scanner.stats, max_size=max_size, max_pixels=max_pixels
+                )
+            
+            for idx, result in enumerate(results, 1):
+                file = os.path.basename(result.input_path)
+                # 扫描结束前显示已扫描数量，结束后显示真实总数
+                total_label = scanner.total_label()
+                if result:
+                    size = result.output_size
+                    total_size += size
+                    success_count += 1
+                    if mode == "quality":
+                        self.log(f"✔ [{idx}/{total_label}] {file} → {format_size(size)}")
+                    else:
+                        self.log(
+                            f"✔ [{idx}/{total_label}] {file} → {format_size(size)} (累计: {format_size(total_size)})"
+                        )
+                else:
+                    fail_count += 1
+                    self.log(f"✖ [{idx}/{total_label}] {file} 压缩失败: {result.error}")
                 
-                for idx, (root, file) in enumerate(image_files, 1):
-                    input_file_path = os.path.join(root, file)
-                    output_file_path = get_output_path(input_file_path, input_path, output_dir)
-                    
-                    try:
-                        if compress_image_to_size(input_file_path, output_file_path, target_size_per_image):
-                            size = os.path.getsize(output_file_path)
-                            total_size += size
-                            success_count += 1
-                            self.log(f"✔ [{idx}/{total_files}] {file} → {format_size(size)} (累计: {format_size(total_size)})")
-                        else:
-                            fail_count += 1
-                            self.log(f"✖ [{idx}/{total_files}] {file} 压缩失败")
-                    except Exception as e:
-                        fail_count += 1
-                        self.log(f"✖ [{idx}/{total_files}] {file} 压缩失败: {str(e)}")
-                    
-                    progress = (idx / total_files) * 100
-                    self.progress_var.set(progress)
-                    self.progress_label.config(text=f"处理中: {idx}/{total_files}")
-                    self.root.update_idletasks()
+                progress = (idx / max(scanner.count, 1)) * 100
+                self.progress_var.set(progress)
+                self.progress_label.config(text=f"处理中: {idx}/{total_label}")
+                self.root.update_idletasks()
+            
+            if scanner.count == 0:
+                self.log("❌ 未找到任何图片文件！")
+                messagebox.showwarning("警告", "未找到任何图片文件！")
+                return
             
             self.log("\n" + "="*50)
             self.log("=== 处理完成 ===")
@@ -465,6 +535,7 @@ class ImageCompressorGUI:
             if fail_count > 0:
                 self.log(f"失败: {fail_count} 张")
             self.log(f"总大小: {format_size(total_size)}")
+            self.log(f"缓存命中: {cache.hits}/{cache.hits + cache.misses} ({cache.hit_rate():.1%})")
             self.log(f"输出目录: {output_dir}")
             
             if mode == "size":
@@ -474,7 +545,7 @@ class ImageCompressorGUI:
                     overflow = total_size - total_max_size
                     self.log(f"⚠ 超出目标大小 {format_size(overflow)}")
             
-            self.progress_label.config(text=f"完成: {success_count}/{total_files}")
+            self.progress_label.config(text=f"完成: {success_count}/{scanner.count}")
             messagebox.showinfo("完成", f"压缩完成！\n成功: {success_count} 张\n失败: {fail_count} 张")
         
         except Exception as e:
@@ -482,6 +553,10 @@ class ImageCompressorGUI:
             messagebox.showerror("错误", f"发生错误: {str(e)}")
         
         finally:
+            if scanner is not None:
+                scanner.close()
+            if cache is not None:
+                cache.close()
             self.is_processing = False
             self.start_button.config(state="normal")
 
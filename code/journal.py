@@ -0,0 +1,150 @@
+"""
+批量压缩进度日志模块
+每完成一张图片向输出目录中的日志文件追加一行记录，中断后可据此跳过已完成的图片
+"""
+import json
+import os
+
+from cache import make_params_key
+from compressors import CompressionResult
+
+JOURNAL_FILENAME = ".compress_journal.jsonl"
+
+
+class Journal:
+    """只追加的进度日志（JSON Lines 文件，保存在输出目录中）"""
+
+    def __init__(self, output_dir, resume=False, stats=None):
+        """
+        Args:
+            output_dir: 输出目录
+            resume: 是否读取已有日志并跳过其中已完成的图片；否则清空日志重新开始
+            stats: 扫描时记录的 {path: (size, mtime_ns)}，核对时不再 stat 输入文件
+        """
+        self.path = os.path.join(output_dir, JOURNAL_FILENAME)
+        self.stats = stats if stats is not None else {}
+        self.resumed = 0
+        self.entries = self._load() if resume else {}
+        self.file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """关闭日志（可重复调用）"""
+        self.file.close()
+
+    def discard(self):
+        """关闭并删除日志（整批已全部完成时调用）"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def exists(output_dir):
+        """
+        输出目录中是否有上次运行留下的日志
+
+        Args:
+            output_dir: 输出目录
+
+        Returns:
+            bool: 是否存在非空日志
+        """
+        path = os.path.join(output_dir, JOURNAL_FILENAME)
+        return os.path.isfile(path) and os.path.getsize(path) > 0
+
+    def _load(self):
+        """读取已有日志，进程被强制结束时最后一行可能不完整，直接忽略"""
+        entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[entry["input_path"], entry["params"]] = entry
+        except OSError:
+            pass
+        return entries
+
+    def _input_stat(self, input_path):
+        stat = self.stats.get(input_path)
+        if stat is None:
+            result = os.stat(input_path)
+            stat = (result.st_size, result.st_mtime_ns)
+        return stat
+
+    def lookup(self, kind, job):
+        """
+        查找上次运行中已完成的结果
+
+        输入文件未变化、输出路径相同（不含按格式替换的扩展名）且输出文件大小
+        与记录一致时视为已完成
+
+        Args:
+            kind: 压缩类型（压缩函数名）
+            job: (input_path, output_path, *params)
+
+        Returns:
+            CompressionResult | None: 已完成时返回记录的结果，否则为 None
+        """
+        if not self.entries:
+            return None
+        input_path, output_path = job[0], job[1]
+        entry = self.entries.get((input_path, make_params_key(kind, job)))
+        if entry is None:
+            return None
+        recorded_output_path = entry["output_path"]
+        if os.path.splitext(recorded_output_path)[0] != os.path.splitext(output_path)[0]:
+            return None
+        try:
+            if self._input_stat(input_path) != (entry["input_size"], entry["input_mtime_ns"]):
+                return None
+            if os.path.getsize(recorded_output_path) != entry["output_size"]:
+                return None
+        except OSError:
+            return None
+
+        self.resumed += 1
+        return CompressionResult(
+            input_path,
+            recorded_output_path,
+            input_size=entry["input_size"],
+            output_size=entry["output_size"],
+            quality=entry.get("quality"),
+            scale=entry.get("scale", 1.0),
+            cached=True,
+        )
+
+    def record(self, kind, job, result):
+        """
+        追加一条已完成的记录，每条记录写入后立即刷新到文件
+
+        Args:
+            kind: 压缩类型（压缩函数名）
+            job: (input_path, output_path, *params)
+            result: 成功的 CompressionResult
+        """
+        try:
+            input_size, input_mtime_ns = self._input_stat(job[0])
+        except OSError:
+            return
+        entry = {
+            "input_path": job[0],
+            "params": make_params_key(kind, job),
+            "input_size": input_size,
+            "input_mtime_ns": input_mtime_ns,
+            "output_path": result.output_path,
+            "output_size": result.output_size,
+            "quality": result.quality,
+            "scale": result.scale,
+        }
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
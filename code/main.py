@@ -1,6 +1,10 @@
 """
 主程序入口
 支持GUI和CLI两种模式
+
+    python main.py                   # GUI模式
+    python main.py --cli             # 交互式命令行
+    python main.py --cli --input DIR --quality 80 --jobs 8   # 非交互命令行
 """
 import sys
 import os
@@ -10,9 +14,9 @@ def main():
     """主函数"""
     # 检查是否有命令行参数
     if len(sys.argv) > 1 and sys.argv[1] == "--cli":
-        # CLI模式
+        # CLI模式，--cli 之后带参数时以非交互方式运行
         from cli import main as cli_main
-        cli_main()
+        sys.exit(cli_main(sys.argv[2:]))
     else:
         # GUI模式（默认）
         try:
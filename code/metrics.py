@@ -0,0 +1,313 @@
+"""
+压缩过程计量模块
+记录每张图片各阶段（解码、转换、缩放、编码、写入）的耗时、试编码次数、缩略图试编码次数和内存峰值，
+并汇总为带分位数的 JSON 运行报告
+"""
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+# 运行报告中统计的分位数
+REPORT_PERCENTILES = (50, 90, 99)
+
+# 运行报告中列出的最慢图片数
+SLOWEST_COUNT = 10
+
+_local = threading.local()
+
+
+def get_peak_rss():
+    """
+    获取当前进程的内存峰值（RSS）
+
+    Returns:
+        int | None: 字节数，平台不支持时为 None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def reset_peak_rss():
+    """
+    重置当前进程的内存峰值（Linux 向 /proc/self/clear_refs 写入 5，重置 VmHWM）
+
+    Returns:
+        bool: 是否重置成功，其他平台为 False
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def get_rss_high_water_mark():
+    """
+    获取当前进程自上次 reset_peak_rss 以来的内存峰值（/proc/self/status 中的 VmHWM）
+
+    Returns:
+        int | None: 字节数，无法读取时为 None
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class ImageMetrics:
+    """单张图片的计量记录"""
+
+    def __init__(self, input_path):
+        """
+        Args:
+            input_path: 输入图片路径
+        """
+        self.input_path = input_path
+        self.stages = {}
+        self.trial_encodes = 0
+        # 拟合质量模型时缩略图的试编码次数，单独统计以免与整图编码混在一起
+        self.probe_encodes = 0
+        self.elapsed = 0.0
+        # 处理这张图片期间的内存峰值，平台不支持按图片重置时为 None
+        self.peak_rss = None
+        # 不能按图片重置时记录工作进程至今的内存峰值，不计入按图片的分位数
+        self.worker_peak_rss = None
+        self.success = False
+        self.cached = False
+        self.passthrough = False
+        self.kept_original = False
+        self.deduplicated = False
+
+    def add_stage(self, name, seconds):
+        """累加某个阶段的耗时"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: 可序列化为 JSON 的记录
+        """
+        return {
+            "input_path": self.input_path,
+            "success": self.success,
+            "cached": self.cached,
+            "passthrough": self.passthrough,
+            "kept_original": self.kept_original,
+            "deduplicated": self.deduplicated,
+            "elapsed": self.elapsed,
+            "stages": self.stages,
+            "trial_encodes": self.trial_encodes,
+            "probe_encodes": self.probe_encodes,
+            "peak_rss": self.peak_rss,
+            "worker_peak_rss": self.worker_peak_rss,
+        }
+
+
+def _current():
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def stage(name):
+    """
+    统计代码块的耗时并计入当前图片的指定阶段，未启用计量时不做任何事
+
+    Args:
+        name: 阶段名（decode / convert / resize / encode / probe / write）
+    """
+    metrics = _current()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_stage(name, time.perf_counter() - start)
+
+
+def count_trial_encode():
+    """为当前图片记录一次试编码，未启用计量时不做任何事"""
+    metrics = _current()
+    if metrics is not None:
+        metrics.trial_encodes += 1
+
+
+def count_probe_encode():
+    """为当前图片记录一次缩略图试编码，未启用计量时不做任何事"""
+    metrics = _current()
+    if metrics is not None:
+        metrics.probe_encodes += 1
+
+
+def measure(func, *args, **kwargs):
+    """
+    在计量下执行压缩函数（模块级函数，以便传给子进程）
+
+    Args:
+        func: 压缩函数
+        *args: 传给 func 的位置参数，第一个为输入图片路径
+        **kwargs: 传给 func 的关键字参数
+
+    Returns:
+        tuple: (func 的返回值, ImageMetrics)
+    """
+    metrics = ImageMetrics(args[0])
+    _local.metrics = metrics
+    # 每个工作进程同一时间只处理一张图片，重置进程峰值后得到的就是这张图片的峰值
+    per_image = reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        metrics.elapsed = time.perf_counter() - start
+        if per_image:
+            metrics.peak_rss = get_rss_high_water_mark()
+        else:
+            metrics.worker_peak_rss = get_peak_rss()
+        _local.metrics = None
+    metrics.success = bool(result)
+    metrics.passthrough = getattr(result, "passthrough", False)
+    metrics.kept_original = getattr(result, "kept_original", False)
+    return result, metrics
+
+
+def _percentiles(values, total=True):
+    """
+    计算最近秩分位数
+
+    Args:
+        values: 数值列表
+        total: 是否包含合计（内存峰值的合计没有意义）
+
+    Returns:
+        dict: {"count", "total", "p50", "p90", "p99", "max"}，没有数值时为空字典
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    summary = {"count": len(values)}
+    if total:
+        summary["total"] = sum(values)
+    for percentile in REPORT_PERCENTILES:
+        rank = max(1, -(-percentile * len(values) // 100))
+        summary[f"p{percentile}"] = values[rank - 1]
+    summary["max"] = values[-1]
+    return summary
+
+
+class RunReport:
+    """批量压缩的运行报告"""
+
+    def __init__(self):
+        self.records = []
+        self.started = time.perf_counter()
+        self.wall_time = None
+
+    def add(self, metrics):
+        """
+        添加一张图片的计量记录
+
+        Args:
+            metrics: ImageMetrics 实例
+        """
+        self.records.append(metrics)
+
+    def add_cached(self, input_path):
+        """
+        添加一张命中缓存、未实际压缩的图片
+
+        Args:
+            input_path: 输入图片路径
+        """
+        metrics = ImageMetrics(input_path)
+        metrics.success = True
+        metrics.cached = True
+        self.records.append(metrics)
+
+    def add_deduplicated(self, input_path):
+        """
+        添加一张与其他图片内容相同、共用其输出的图片
+
+        Args:
+            input_path: 输入图片路径
+        """
+        metrics = ImageMetrics(input_path)
+        metrics.success = True
+        metrics.deduplicated = True
+        self.records.append(metrics)
+
+    def finish(self):
+        """记录整批的墙钟耗时"""
+        self.wall_time = time.perf_counter() - self.started
+
+    def summary(self):
+        """
+        汇总运行报告
+
+        Returns:
+            dict: 各阶段耗时、单张总耗时、试编码次数、缩略图试编码次数和单张内存峰值的分位数，
+                工作进程的内存峰值（不能按图片统计时），以及最慢的若干张图片
+        """
+        measured = [metrics for metrics in self.records if not metrics.cached and not metrics.deduplicated]
+        stage_names = sorted({name for metrics in measured for name in metrics.stages})
+        slowest = sorted(measured, key=lambda metrics: metrics.elapsed, reverse=True)
+
+        return {
+            "images": len(self.records),
+            "failed": sum(not metrics.success for metrics in self.records),
+            "cache_hits": sum(metrics.cached for metrics in self.records),
+            # 与其他图片内容相同、共用其输出的图片数
+            "deduplicated": sum(metrics.deduplicated for metrics in self.records),
+            # 原图质量已不高于要求、直接复用而未重新编码的图片数
+            "passthrough": sum(metrics.passthrough for metrics in measured),
+            # 重新编码不比原图小、保留原图的图片数
+            "kept_original": sum(metrics.kept_original for metrics in measured),
+            "wall_time": self.wall_time,
+            "elapsed": _percentiles([metrics.elapsed for metrics in measured]),
+            "stages": {
+                name: _percentiles([metrics.stages.get(name, 0.0) for metrics in measured])
+                for name in stage_names
+            },
+            "trial_encodes": _percentiles([metrics.trial_encodes for metrics in measured]),
+            "probe_encodes": _percentiles([metrics.probe_encodes for metrics in measured]),
+            "peak_rss": _percentiles(
+                [metrics.peak_rss for metrics in measured if metrics.peak_rss is not None],
+                total=False,
+            ),
+            # 进程累计的峰值不对应单张图片，只给出最大值
+            "worker_peak_rss": max(
+                (metrics.worker_peak_rss for metrics in measured if metrics.worker_peak_rss is not None),
+                default=None,
+            ),
+            "slowest": [metrics.to_dict() for metrics in slowest[:SLOWEST_COUNT]],
+        }
+
+    def write(self, path):
+        """
+        将运行报告写入 JSON 文件（包含每张图片的记录）
+
+        Args:
+            path: 报告文件路径
+        """
+        if self.wall_time is None:
+            self.finish()
+        report = self.summary()
+        report["records"] = [metrics.to_dict() for metrics in self.records]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
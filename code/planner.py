@@ -0,0 +1,162 @@
+"""
+目标总大小预算分配模块
+根据每张图片的质量-大小估算曲线，在总预算内分配每张图片的目标大小
+"""
+from compressors import MAX_QUALITY, MIN_QUALITY
+
+# 估算质量-大小曲线时使用的采样质量
+PLAN_QUALITIES = (15, 35, 55, 75, 95)
+
+
+def _interpolate_size(curve, quality):
+    """
+    在质量-大小曲线上线性插值
+
+    Args:
+        curve: [(quality, size), ...]，按质量升序
+        quality: 要估算的质量
+
+    Returns:
+        float: 估算大小（字节）
+    """
+    if quality <= curve[0][0]:
+        return curve[0][1]
+    for (q0, s0), (q1, s1) in zip(curve, curve[1:]):
+        if quality <= q1:
+            return s0 + (s1 - s0) * (quality - q0) / (q1 - q0)
+    return curve[-1][1]
+
+
+def _make_monotonic(curve):
+    """
+    保证估算大小随质量单调不减（小图试编码可能出现轻微抖动）
+
+    Args:
+        curve: [(quality, size), ...]，按质量升序
+
+    Returns:
+        list: 单调化后的曲线
+    """
+    result = []
+    largest = 0
+    for quality, size in curve:
+        largest = max(largest, size)
+        result.append((quality, largest))
+    return result
+
+
+def _cap_curve(curve, cap):
+    """
+    将曲线上超过原图大小的估算值截断为原图大小（压缩器会直接保留原图）
+
+    Args:
+        curve: [(quality, size), ...]
+        cap: 原图大小（字节），None 表示不截断
+
+    Returns:
+        list: 截断后的曲线
+    """
+    if cap is None:
+        return curve
+    return [(quality, min(size, cap)) for quality, size in curve]
+
+
+def _distribute(budget, estimates, caps):
+    """
+    按估算大小比例分配预算，分到的目标不小于原图大小的图片直接保留原图，
+    只占用原图大小，多出的预算重新分给其余图片
+
+    Args:
+        budget: 可分配的总预算（字节）
+        estimates: {idx: 估算大小}
+        caps: {idx: 原图大小}，没有上限的图片不在其中
+
+    Returns:
+        dict: {idx: 目标大小}
+    """
+    targets = {}
+    remaining = dict(estimates)
+    while remaining:
+        estimated_total = sum(remaining.values())
+        capped = [
+            idx
+            for idx, estimate in remaining.items()
+            if idx in caps and budget * estimate / estimated_total >= caps[idx]
+        ]
+        if not capped:
+            break
+        for idx in capped:
+            targets[idx] = caps[idx]
+            budget -= caps[idx]
+            del remaining[idx]
+
+    estimated_total = sum(remaining.values())
+    for idx, estimate in remaining.items():
+        targets[idx] = int(budget * estimate / estimated_total)
+    return targets
+
+
+def plan_target_sizes(
+    size_curves, total_size, min_quality=MIN_QUALITY, max_quality=MAX_QUALITY, input_sizes=None
+):
+    """
+    在总预算内为每张图片分配目标大小
+
+    所有图片使用同一个质量时，各图片的失真程度大致相当，
+    因此查找总估算大小不超过预算的最高统一质量，再按该质量下的
+    估算大小比例分配预算。小图只拿到自己需要的字节，
+    节省的预算自然流向大图。给出原图大小时，重新编码不会比原图小的图片
+    按原图大小计入预算（压缩器会保留原图），省下的预算分给其余图片
+
+    Args:
+        size_curves: 每张图片的 [(quality, size), ...] 估算曲线，估算失败的图片为 None
+        total_size: 目标总大小（字节）
+        min_quality: 最低质量
+        max_quality: 最高质量
+        input_sizes: 与 size_curves 一一对应的原图大小列表（字节），None 表示不考虑保留原图
+
+    Returns:
+        tuple: (target_sizes, quality)，与 size_curves 一一对应的目标大小列表，
+            以及规划出的统一质量（最低质量仍超出预算时为 None）
+    """
+    count = len(size_curves)
+    if count == 0:
+        return [], None
+
+    # 估算失败的图片按平均值预留预算
+    even_share = total_size // count
+    caps = {}
+    if input_sizes is not None:
+        caps = {idx: size for idx, size in enumerate(input_sizes) if size}
+    curves = {
+        idx: _cap_curve(_make_monotonic(curve), caps.get(idx))
+        for idx, curve in enumerate(size_curves)
+        if curve
+    }
+    budget = total_size - even_share * (count - len(curves))
+    target_sizes = [even_share] * count
+
+    if not curves:
+        return target_sizes, None
+
+    def estimate_total(quality):
+        return sum(_interpolate_size(curve, quality) for curve in curves.values())
+
+    # 二分查找总估算大小不超过预算的最高质量
+    low, high = min_quality, max_quality
+    planned_quality = None
+    while low <= high:
+        quality = (low + high) // 2
+        if estimate_total(quality) <= budget:
+            planned_quality = quality
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    # 最低质量仍超出预算时，按最低质量下的比例分配（这些图片将进入缩小尺寸的流程）
+    quality = planned_quality if planned_quality is not None else min_quality
+    estimates = {idx: max(_interpolate_size(curve, quality), 1) for idx, curve in curves.items()}
+    for idx, target_size in _distribute(budget, estimates, caps).items():
+        target_sizes[idx] = target_size
+
+    return target_sizes, planned_quality
@@ -0,0 +1,95 @@
+"""
+跨图片质量预测模块
+目标大小批量压缩时，根据已完成图片的特征和最终质量在线拟合回归模型，
+为后续图片预测满足目标大小的质量，作为质量搜索的起点
+"""
+import math
+
+import numpy as np
+
+# 每种格式至少有这么多条记录后才开始预测
+MIN_OBSERVATIONS = 4
+
+# 岭回归的正则化系数（不作用于常数项），记录很少时避免过拟合
+RIDGE = 1e-3
+
+
+def feature_vector(features):
+    """
+    将图片特征转为回归用的特征向量
+
+    Args:
+        features: (target_bpp, source_bpp, variance)，目标每像素字节数、
+            原图文件每像素字节数和缩略图灰度方差
+
+    Returns:
+        numpy.ndarray: [1, log(target_bpp), log(source_bpp), log(1 + variance)]
+    """
+    target_bpp, source_bpp, variance = features
+    return np.array([1.0, math.log(target_bpp), math.log(source_bpp), math.log1p(variance)])
+
+
+def predict_quality(coefficients, image_format, features):
+    """
+    用回归系数预测质量
+
+    Args:
+        coefficients: QualityPredictor.snapshot() 的返回值
+        image_format: 原图格式（Pillow 格式名）
+        features: (target_bpp, source_bpp, variance)
+
+    Returns:
+        float | None: 预测的质量（未限制范围），该格式的记录不足时为 None
+    """
+    weights = coefficients.get(image_format) if coefficients else None
+    if weights is None:
+        return None
+    return float(np.dot(weights, feature_vector(features)))
+
+
+class QualityPredictor:
+    """按原图格式分别拟合的在线岭回归，特征到最终质量的映射"""
+
+    def __init__(self):
+        # {格式: [X^T X, X^T y, 记录数]}
+        self.sums = {}
+        self._snapshot = None
+
+    def observe(self, image_format, features, quality):
+        """
+        记录一张图片的特征和满足目标大小的最终质量
+
+        Args:
+            image_format: 原图格式（Pillow 格式名）
+            features: (target_bpp, source_bpp, variance)
+            quality: 最终质量
+        """
+        x = feature_vector(features)
+        if image_format not in self.sums:
+            self.sums[image_format] = [np.zeros((len(x), len(x))), np.zeros(len(x)), 0]
+        sums = self.sums[image_format]
+        sums[0] += np.outer(x, x)
+        sums[1] += x * quality
+        sums[2] += 1
+        self._snapshot = None
+
+    def snapshot(self):
+        """
+        求解当前的回归系数（结果会缓存到下一次 observe）
+
+        Returns:
+            dict: {格式: 系数元组}，只包含记录数足够的格式；可传给子进程
+        """
+        if self._snapshot is None:
+            self._snapshot = {}
+            for image_format, (xtx, xty, count) in self.sums.items():
+                if count < MIN_OBSERVATIONS:
+                    continue
+                ridge = np.eye(len(xty)) * RIDGE
+                ridge[0, 0] = 0.0
+                try:
+                    weights = np.linalg.solve(xtx + ridge * count, xty)
+                except np.linalg.LinAlgError:
+                    continue
+                self._snapshot[image_format] = tuple(weights.tolist())
+        return self._snapshot
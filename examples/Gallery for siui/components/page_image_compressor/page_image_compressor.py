@@ -28,8 +28,9 @@ _current_dir = os.path.dirname(os.path.abspath(__file__))
 _project_root = os.path.abspath(os.path.join(_current_dir, '../../../../'))
 _code_dir = os.path.join(_project_root, 'code')
 sys.path.insert(0, _code_dir)
-from compressors import compress_image_fixed_quality, compress_image_to_size
-from file_utils import get_image_files, get_output_path, format_size
+from batch import compress_batch_fixed_quality, compress_batch_to_size, get_default_workers, plan_batch_to_size
+from cache import ResultCache
+from file_utils import ImageScanner, format_size, iter_file_pairs
 
 
 class CompressionWorker(QThread):
@@ -38,13 +39,19 @@ class CompressionWorker(QThread):
     log_message = pyqtSignal(str)  # 日志消息
     finished = pyqtSignal(int, int, int)  # 成功数, 失败数, 总大小
 
-    def __init__(self, input_path, output_dir, mode, quality=None, target_size_mb=None):
+    def __init__(
+        self, input_path, output_dir, mode, quality=None, target_size_mb=None, workers=None,
+        max_size=None, max_pixels=None,
+    ):
         super().__init__()
         self.input_path = input_path
         self.output_dir = output_dir
         self.mode = mode
         self.quality = quality
         self.target_size_mb = target_size_mb
+        self.workers = workers
+        self.max_size = max_size
+        self.max_pixels = max_pixels
         self.is_cancelled = False
 
     def cancel(self):
@@ -53,78 +60,91 @@ class CompressionWorker(QThread):
 
     def run(self):
         """执行压缩"""
+        scanner = None
+        cache = None
         try:
             os.makedirs(self.output_dir, exist_ok=True)
             
-            self.log_message.emit("正在扫描图片文件...")
-            image_files = get_image_files(self.input_path)
-            
-            if not image_files:
-                self.log_message.emit("❌ 未找到任何图片文件！")
-                self.finished.emit(0, 0, 0)
-                return
-            
-            total_files = len(image_files)
-            self.log_message.emit(f"找到 {total_files} 张图片\n")
-            
             total_size = 0
             success_count = 0
             fail_count = 0
             
-            if self.mode == "quality":
-                self.log_message.emit(f"开始压缩（质量: {self.quality}）...\n")
+            # 后台线程扫描图片文件，固定质量模式边扫描边压缩
+            scanner = ImageScanner(self.input_path, self.output_dir)
+            if self.mode == "size":
+                # 目标大小模式需要先知道全部图片才能分配预算
+                self.log_message.emit("正在扫描图片文件...")
+                image_files = list(scanner)
+                
+                if not image_files:
+                    self.log_message.emit("❌ 未找到任何图片文件！")
+                    self.finished.emit(0, 0, 0)
+                    return
                 
-                for idx, (root, file) in enumerate(image_files, 1):
-                    if self.is_cancelled:
-                        break
-                    
-                    input_file_path = os.path.join(root, file)
-                    output_file_path = get_output_path(input_file_path, self.input_path, self.output_dir)
-                    
-                    try:
-                        if compress_image_fixed_quality(input_file_path, output_file_path, self.quality):
-                            size = os.path.getsize(output_file_path)
-                            total_size += size
-                            success_count += 1
-                            self.log_message.emit(f"✔ [{idx}/{total_files}] {file} → {format_size(size)}")
-                        else:
-                            fail_count += 1
-                            self.log_message.emit(f"✖ [{idx}/{total_files}] {file} 压缩失败")
-                    except Exception as e:
-                        fail_count += 1
-                        self.log_message.emit(f"✖ [{idx}/{total_files}] {file} 压缩失败: {str(e)}")
-                    
-                    self.progress_updated.emit(idx, total_files)
+                self.log_message.emit(f"找到 {len(image_files)} 张图片\n")
+            else:
+                image_files = scanner
             
+            file_pairs = iter_file_pairs(image_files, self.input_path, self.output_dir)
+            
+            # 以内容哈希和压缩参数为键的结果缓存，重复运行时跳过未变化的图片
+            cache = ResultCache(self.output_dir, scanner.stats)
+            
+            if self.mode == "quality":
+                self.log_message.emit(f"开始压缩（质量: {self.quality}）...\n")
+                results = compress_batch_fixed_quality(
+                    file_pairs, self.quality, self.workers, cache, scanner.stats,
+                    max_size=self.max_size, max_pixels=self.max_pixels,
+                )
             else:  # size mode
                 total_max_size = int(self.target_size_mb * 1024 * 1024)
-                target_size_per_image = total_max_size // total_files
                 
                 self.log_message.emit(f"目标总大小: {format_size(total_max_size)}")
-                self.log_message.emit(f"平均每张目标大小: {format_size(target_size_per_image)}\n")
+                self.log_message.emit("正在分析图片，分配每张图片的目标大小...")
+                input_paths = [os.path.join(root, file) for root, file in image_files]
+                target_sizes, planned_quality = plan_batch_to_size(
+                    input_paths, total_max_size, self.workers, scanner.stats, self.max_size, self.max_pixels, cache
+                )
+                if planned_quality is not None:
+                    self.log_message.emit(f"预估统一质量: {planned_quality}\n")
+                else:
+                    self.log_message.emit("⚠ 预算不足，部分图片将缩小尺寸\n")
+                results = compress_batch_to_size(
+                    file_pairs, target_sizes, self.workers, cache, scanner.stats,
+                    max_size=self.max_size, max_pixels=self.max_pixels,
+                )
+            
+            # 结果按完成顺序返回，idx 表示已完成的数量
+            for idx, result in enumerate(results, 1):
+                file = os.path.basename(result.input_path)
+                # 扫描结束前显示已扫描数量，结束后显示真实总数
+                total_label = scanner.total_label()
+                if result:
+                    size = result.output_size
+                    total_size += size
+                    success_count += 1
+                    if self.mode == "quality":
+                        self.log_message.emit(f"✔ [{idx}/{total_label}] {file} → {format_size(size)}")
+                    else:
+                        self.log_message.emit(
+                            f"✔ [{idx}/{total_label}] {file} → {format_size(size)} (累计: {format_size(total_size)})"
+                        )
+                else:
+                    fail_count += 1
+                    self.log_message.emit(f"✖ [{idx}/{total_label}] {file} 压缩失败: {result.error}")
                 
-                for idx, (root, file) in enumerate(image_files, 1):
-                    if self.is_cancelled:
-                        break
-                    
-                    input_file_path = os.path.join(root, file)
-                    output_file_path = get_output_path(input_file_path, self.input_path, self.output_dir)
-                    
-                    try:
-                        if compress_image_to_size(input_file_path, output_file_path, target_size_per_image):
-                            size = os.path.getsize(output_file_path)
-                            total_size += size
-                            success_count += 1
-                            self.log_message.emit(f"✔ [{idx}/{total_files}] {file} → {format_size(size)} (累计: {format_size(total_size)})")
-                        else:
-                            fail_count += 1
-                            self.log_message.emit(f"✖ [{idx}/{total_files}] {file} 压缩失败")
-                    except Exception as e:
-                        fail_count += 1
-                        self.log_message.emit(f"✖ [{idx}/{total_files}] {file} 压缩失败: {str(e)}")
-                    
-                    self.progress_updated.emit(idx, total_files)
+                self.progress_updated.emit(idx, scanner.count)
                 
+                if self.is_cancelled:
+                    results.close()
+                    break
+            
+            if scanner.count == 0:
+                self.log_message.emit("❌ 未找到任何图片文件！")
+                self.finished.emit(0, 0, 0)
+                return
+            
+            if self.mode == "size":
                 # 在 size 模式下检查是否达到目标大小
                 self.log_message.emit("\n" + "="*50)
                 self.log_message.emit("=== 处理完成 ===")
@@ -132,6 +152,7 @@ class CompressionWorker(QThread):
                 if fail_count > 0:
                     self.log_message.emit(f"失败: {fail_count} 张")
                 self.log_message.emit(f"总大小: {format_size(total_size)}")
+                self.log_message.emit(f"缓存命中: {cache.hits}/{cache.hits + cache.misses} ({cache.hit_rate():.1%})")
                 self.log_message.emit(f"输出目录: {self.output_dir}")
                 
                 if total_size <= total_max_size:
@@ -150,6 +171,7 @@ class CompressionWorker(QThread):
             if fail_count > 0:
                 self.log_message.emit(f"失败: {fail_count} 张")
             self.log_message.emit(f"总大小: {format_size(total_size)}")
+            self.log_message.emit(f"缓存命中: {cache.hits}/{cache.hits + cache.misses} ({cache.hit_rate():.1%})")
             self.log_message.emit(f"输出目录: {self.output_dir}")
             
             self.finished.emit(success_count, fail_count, total_size)
@@ -157,6 +179,12 @@ class CompressionWorker(QThread):
         except Exception as e:
             self.log_message.emit(f"\n❌ 发生错误: {str(e)}")
             self.finished.emit(0, 0, 0)
+        
+        finally:
+            if scanner is not None:
+                scanner.close()
+            if cache is not None:
+                cache.close()
 
 
 class ImageCompressorPage(SiPage):
@@ -294,8 +322,68 @@ class ImageCompressorPage(SiPage):
             size_mode_container.addWidget(self.size_radio)
             size_mode_container.addWidget(size_setting_container)
             
+            # 并行进程数
+            workers_setting_container = SiDenseHContainer(self)
+            workers_setting_container.setSpacing(8)
+            
+            workers_label = SiLabel(self)
+            workers_label.setText("并行进程数:")
+            workers_label.resize(100, 32)
+            
+            self.workers_spinbox = SiIntSpinBox(self)
+            self.workers_spinbox.setMinimum(1)
+            self.workers_spinbox.setMaximum(256)
+            self.workers_spinbox.setValue(get_default_workers())
+            self.workers_spinbox.resize(100, 32)
+            
+            workers_hint_label = SiLabel(self)
+            workers_hint_label.setText(f"(默认为CPU核心数 {get_default_workers()})")
+            workers_hint_label.setStyleSheet("color: {}".format(SiGlobal.siui.colors["TEXT_B"]))
+            
+            workers_setting_container.addWidget(workers_label)
+            workers_setting_container.addWidget(self.workers_spinbox)
+            workers_setting_container.addWidget(workers_hint_label)
+            
+            # 尺寸限制（超出时等比缩小，0 为不限制）
+            resize_setting_container = SiDenseHContainer(self)
+            resize_setting_container.setSpacing(8)
+            
+            max_edge_label = SiLabel(self)
+            max_edge_label.setText("最长边上限:")
+            max_edge_label.resize(100, 32)
+            
+            self.max_edge_spinbox = SiIntSpinBox(self)
+            self.max_edge_spinbox.setMinimum(0)
+            self.max_edge_spinbox.setMaximum(65535)
+            self.max_edge_spinbox.setValue(0)
+            self.max_edge_spinbox.setSingleStep(100)
+            self.max_edge_spinbox.resize(100, 32)
+            
+            max_megapixels_label = SiLabel(self)
+            max_megapixels_label.setText("像素数上限:")
+            max_megapixels_label.resize(100, 32)
+            
+            self.max_megapixels_spinbox = SiDoubleSpinBox(self)
+            self.max_megapixels_spinbox.setMinimum(0.0)
+            self.max_megapixels_spinbox.setMaximum(1000.0)
+            self.max_megapixels_spinbox.setValue(0.0)
+            self.max_megapixels_spinbox.setSingleStep(1.0)
+            self.max_megapixels_spinbox.resize(100, 32)
+            
+            resize_hint_label = SiLabel(self)
+            resize_hint_label.setText("百万像素 (0 为不限制)")
+            resize_hint_label.setStyleSheet("color: {}".format(SiGlobal.siui.colors["TEXT_B"]))
+            
+            resize_setting_container.addWidget(max_edge_label)
+            resize_setting_container.addWidget(self.max_edge_spinbox)
+            resize_setting_container.addWidget(max_megapixels_label)
+            resize_setting_container.addWidget(self.max_megapixels_spinbox)
+            resize_setting_container.addWidget(resize_hint_label)
+            
             mode_container.addWidget(quality_mode_container)
             mode_container.addWidget(size_mode_container)
+            mode_container.addWidget(workers_setting_container)
+            mode_container.addWidget(resize_setting_container)
             
             group.addWidget(mode_container)
         
@@ -444,8 +532,15 @@ class ImageCompressorPage(SiPage):
             self.log_viewer_page.clear_log()
             self.log_viewer_page.append_log("开始新的压缩任务...")
         
+        max_edge = self.max_edge_spinbox.value()
+        max_megapixels = self.max_megapixels_spinbox.value()
+        
         # 创建并启动工作线程
-        self.worker = CompressionWorker(input_path, output_path, mode, quality, target_size_mb)
+        self.worker = CompressionWorker(
+            input_path, output_path, mode, quality, target_size_mb, self.workers_spinbox.value(),
+            (max_edge, max_edge) if max_edge > 0 else None,
+            int(max_megapixels * 1_000_000) if max_megapixels > 0 else None,
+        )
         self.worker.progress_updated.connect(self.on_progress_updated)
         self.worker.log_message.connect(self.log)
         self.worker.finished.connect(self.on_compression_finished)